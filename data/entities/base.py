@@ -11,7 +11,8 @@ class Entity(object):
             'blocking' : 0,
             'visible' : 1,
             'liftable' : 1,
-            'usable' : 1
+            'usable' : 1,
+            'opaque' : 0
         }
         self.id = id
         self.parent = parent
@@ -107,13 +108,14 @@ class Entity(object):
         pass
 
     def get_attributes(self):
-        """Return attributes in string of form 'FBVLU'."""
+        """Return attributes in string of form 'FBVLUO'."""
         ret = ""
         ret += str(self.attributes['fixed'])
         ret += str(self.attributes['blocking'])
         ret += str(self.attributes['visible'])
         ret += str(self.attributes['liftable'])
         ret += str(self.attributes['usable'])
+        ret += str(self.attributes['opaque'])
         return ret
 
 
@@ -126,18 +128,21 @@ class Entity(object):
 
     def set_attribute(self,att,val):
         """Set an attribute to given value."""
+        old = self.attributes.get(att)
         self.attributes[att] = val
+        if old != val:
+            self.parent.attribute_changed(self.id, att, old)
 
     def set_attributes(self,atts):
-        """Set default attributes; takes a string of the form: 'FBVLU'.
+        """Set default attributes; takes a string of the form: 'FBVLU' or 'FBVLUO'.
 
-        Fixed, Blocking, Visible, Liftable, Usable.
+        Fixed, Blocking, Visible, Liftable, Usable, Opaque.
         """
-        if len(atts) != 5:
+        if len(atts) not in (5, 6):
             return
-        assoc = {0:'fixed', 1:'blocking', 2:'visible', 3:'liftable', 4:'usable'}
+        assoc = {0:'fixed', 1:'blocking', 2:'visible', 3:'liftable', 4:'usable', 5:'opaque'}
         for id in range(len(atts)):
-            self.attributes[assoc[id]] = int(atts[id])
+            self.set_attribute(assoc[id], int(atts[id]))
 
     def set_name(self,name):
         """Set the entity's name."""
@@ -1,4 +1,3 @@
-import random
 from data.entities import Entity
 
 class Ethereal(Entity):
@@ -28,11 +27,12 @@ class Wound(Ethereal):
 
     def update(self):
         if self.damage:
+            rng = self.parent.get_rng('combat')
             if 100 > self.damage > self.high_threshold:
-                if random.randint(0,100) < self.worsen_chance:
+                if rng.randint(0,100) < self.worsen_chance:
                     self.set_damage(self.damage+1)
             elif self.damage < self.low_threshold:
-                if random.randint(0,100) < self.heal_chance:
+                if rng.randint(0,100) < self.heal_chance:
                     self.set_damage(self.damage-1)
         if self.damage <= 0:
             self.parent.set_parent(self.id, self.parent.garbage_id)
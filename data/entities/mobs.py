@@ -1,7 +1,5 @@
 from data.entities import Entity
 
-import random
-
 class Mob(Entity):
 
     def init(self):
@@ -40,7 +38,7 @@ class Mob(Entity):
 
     def update(self):
         if not self.check_damage():
-            dx, dy = random.randint(-1,1), random.randint(-1,1)
+            dx, dy = self.parent.get_rng('ai').randints(-1,1,2)
             self.move(dx, dy)
 
 class Humanoid(Mob):
@@ -107,7 +105,7 @@ class Humanoid(Mob):
 
     def deal_damage(self, amount, target=None):
         if not target:
-            target = random.choice(self.bodyparts)
+            target = self.parent.get_rng('combat').choice(self.bodyparts)
         if not self.get_injury(target):
             wound = self.parent.add_entity('wound')
             self.parent[wound].set_damage(amount)
@@ -9,4 +9,7 @@ class Obstacle(Entity):
         self.char = 'O'
 
 class Boulder(Obstacle):
-    pass
\ No newline at end of file
+
+    def init(self):
+        super(Boulder,self).init()
+        self.set_attribute('opaque',1)
\ No newline at end of file
@@ -19,6 +19,7 @@ class Door(Trap):
         self.char = "+"
         self.name = "door"
         self.fgcol = (255, 150, 0)
+        self.set_attribute("opaque",1)
 
     def was_collided(self,id):
         success = True
@@ -32,12 +33,14 @@ class Door(Trap):
             self.opened = 1
             self.char = " "
             self.set_attribute("blocking",0)
+            self.set_attribute("opaque",0)
 
     def close(self):
         if self.opened:
             self.opened = 0
             self.char = "+"
             self.set_attribute("blocking",1)
+            self.set_attribute("opaque",1)
 
     def door_toggle(self):
         if self.opened:
@@ -241,6 +241,18 @@ def get_key():
         sys.exit()
     pygame.event.clear(ignore_events)
     ret = [ ]
+    for event in events:
+        ret.append(event)
+    return ret
+
+def poll_key():
+    """Returns the key presses waiting in the event queue, an empty list if there are none; Never waits."""
+    events = pygame.event.get(KEYDOWN)
+    if pygame.event.get(QUIT):
+        pygame.quit()
+        sys.exit()
+    pygame.event.clear(ignore_events)
+    ret = [ ]
     for event in events:
         ret.append(event)
     return ret
\ No newline at end of file
@@ -1,10 +1,13 @@
-import random  # TODO: add libtcod RNG and customisable RNG system.
 import lib.graphics as graphics
 import lib.map as map
+import lib.material as material
 import lib.entity_manager as entity_man
 import lib.interface as interface
 import lib.time as time
 import lib.fov as fov
+import lib.rng as rng
+import lib.level as level
+import lib.world as world
 import json
 
 
@@ -20,9 +23,18 @@ class Application(object):
     to create a main menu, if you wish it. After this, loop while checking if L{exit} is false, and
     run L{self.update} every iteration.
 
+    Set L{scheduler_type} to L{time.WheelScheduler} when most entities share a few delays, and L{map_type} to
+    L{map.ChunkedMap} for very large levels that are mostly wall. For large persistent levels, use L{map.MappedMap}
+    and give the map a file with L{map.MappedMap.set_file}; L{save_state} then just flushes it.
     """
 
-    def __init__(self, name, w, h):
+    # Scheduler class created by L{init_ents}.
+    scheduler_type = time.Scheduler
+
+    # Map class created by L{generate_map} and L{load_state}.
+    map_type = map.Map
+
+    def __init__(self, name, w, h, seed=None):
         """Initialise the application with basic default values.
 
         @type  name: string
@@ -31,14 +43,31 @@ class Application(object):
         @param w: Main window width.
         @type  h: number
         @param h: Main window height.
+        @type  seed: number
+        @param seed: Master seed for the random streams, or None for a random one.
         """
         self.exit = 0
 
+        # All randomness comes from named streams, so that a seed reproduces a whole run.
+        self.rng = rng.RNG(seed)
+
         # One currently loaded map at any one time
         self.map = None
 
+        # Most tasks and seconds a single scheduler tick may run for, None for no limit.
+        self.tick_budget = (None, None)
+
+        # Fixed timestep driving the scheduler in real-time mode, None for turn-based.
+        self.real_time = None
+
         self.init_ents()
 
+        # Levels other than the current one, see L{change_level}.
+        self.levels = level.LevelStack(self)
+
+        # Streaming world generated around the camera, see L{start_world}; None when playing separate levels.
+        self.world = None
+
         self.fov_map = True
 
         # Initialise default windows with None.
@@ -46,6 +75,7 @@ class Application(object):
         self.game_win = None
         self.inv_win = None
         self.msg_win = None
+        self.minimap_win = None
 
         # Initialise colors.
         self.change_color_scheme((0,0,0), (255,255,255), (0,0,0), (255,255,255), (125, 125, 125))
@@ -61,7 +91,8 @@ class Application(object):
     def init_ents(self):
         """Initialises entity systems."""
         # All entities are scheduled in one global scheduler.
-        self.scheduler = time.Scheduler()
+        self.scheduler = self.scheduler_type()
+        self.scheduler.set_budget(*self.tick_budget)
         # Entity management done by EntityManager.
         self.entity_manager = entity_man.EntityManager(self)
         # Player and camera entities are saved so that you could switch cameras
@@ -262,16 +293,61 @@ class Application(object):
         @type  layout: str
         @param layout: Filename of layout file to use.
         """
-        gen = map.BlockGenerator(w,h)
+        gen = map.BlockGenerator(w,h,self.rng['mapgen'],self.map_type)
         gen.set_layout(layout)
         m = gen.gen_map()
         ents = gen.entities
         self.generate_ents(m,ents)
         self.add_map(map=m)
 
+    def change_level(self,name,w=None,h=None,layout='test'):
+        """Makes the named level the current one, generating it if it's new.
+
+        The current level's map, explored state and entities are kept in L{levels}; The player, the camera and what
+        they carry come along, and are left where they were, so move them to the new level's entrance afterwards. A map
+        in use before the first level change is kept as the level named None.
+
+        @type  name: str
+        @param name: Name of the level to go to.
+        @type  w: number
+        @param w: Width of the map, if the level has to be generated.
+        @type  h: number
+        @param h: Height of the map, if the level has to be generated.
+        @type  layout: str
+        @param layout: Filename of layout file to use, if the level has to be generated.
+        @rtype: bool
+        @return: True if the level already existed.
+        """
+        if self.levels.enter(name):
+            return True
+        self.generate_map(w,h,True,layout)
+        return False
+
+    def start_world(self,size=1024,layout='test'):
+        """Starts a streaming world, made a chunk at a time as the camera nears unexplored parts, in place of a map.
+
+        Only the chunk at the centre is generated up front; Call L{place_player} next to start on it. Chunks far from
+        the camera are unloaded to files with their entities as it moves, by L{update}.
+
+        @type  size: number
+        @param size: Width and height of the world, in tiles.
+        @type  layout: str
+        @param layout: Filename of layout file to generate chunks with.
+        @rtype: L{world.World}
+        @return: The world, also kept as L{world}.
+        """
+        if self.world is not None:
+            self.world.clear()
+        self.world = world.World(self, size, layout)
+        self.world.start()
+        return self.world
+
     def save_state(self,file):
         """Saves current game state to a file.
 
+        Inactive levels are saved along with the active one, and a streaming world is saved whole, with its unloaded
+        chunks and the seed the rest are generated from.
+
         @type  file: string
         @param file: Filename of save file.
         """
@@ -279,6 +355,9 @@ class Application(object):
             return
         lines = ['{', '"map" : ']
         lines += self.map.save()
+        if self.world is not None:
+            lines += ['"world" : {0},'.format(json.dumps(self.world.save()))]
+        lines += ['"levels" : {0},'.format(json.dumps(self.levels.save()))]
         lines += ['"ents" : ']
         lines += self.entity_manager.save()
         lines += ['}']
@@ -299,14 +378,15 @@ class Application(object):
             data = json.load(f)
 
         #map
-        new_map = map.Map(*data["map"]["size"])
-        for key in data["map"]:
-            if key != "size":
-                x, y = key.split(",",1)
-                x = int(x)
-                y = int(y)
-                new_map.add_tile(x,y,data["map"][key])
-        self.add_map(new_map)
+        if "world" in data:
+            settings = data["world"]
+            self.world = world.World(self, settings["size"], settings["layout"], settings["radius"],
+                settings["keep"], settings["per_update"])
+            self.world.load(settings, data["map"])
+        else:
+            self.add_map(map.load_map(data["map"], self.map_type))
+        if "levels" in data:
+            self.levels.load(data["levels"])
 
         #ents
         for key in data["ents"]:
@@ -329,10 +409,11 @@ class Application(object):
         """Populates map with entities, takes a list of (x, y, entity_lookup_name, chance),
             where chance is a float in [0,1]."""
         chances = { }
+        stream = self.rng['spawn']
         for set in list:
             x, y, char, ent_string, chance, meta = set
             if char not in chances:
-                chances[char] = random.random()
+                chances[char] = stream.random()
             if chances[char] < chance:
                 ent = self.add_entity(x, y, ent_string)
                 ent_obj = self.entity_manager[ent]
@@ -348,8 +429,13 @@ class Application(object):
         @param map: Map object to add to stack.
         """
         self.map = map
+        self.entity_manager.set_grid(map.get_grid())
         if self.fov_map:
-            self.fov_map = fov.FovMap(map.width,map.height)
+            if map.has_plane:
+                self.fov_map = fov.FovMap(map.width,map.height)
+            else:
+                # explored state in chunks like the map's, so a World can store it away with them
+                self.fov_map = fov.ChunkedFovMap(map.width,map.height,map.chunk_bits)
 
     def add_window(self,layer,type,w,h,x,y):
         """Create a new window and return it.
@@ -622,7 +708,13 @@ class Application(object):
 
     def destroy_ents(self):
         """Destroys all entities, and entity scheduling.
+
+        Inactive levels and the streaming world go too, as their entities' IDs would clash with new ones.
         """
+        self.levels.clear()
+        if self.world is not None:
+            self.world.clear()
+            self.world = None
         self.init_ents()
 
     def collision_check(self, id, x, y):
@@ -636,15 +728,14 @@ class Application(object):
             if not pos:
                 return False
             ex, ey = pos
-            # check for wall
-            if self.map.get_tile(x + ex, y + ey)[0]:
-                can_move = False
             # check if we're blocking or not
             if self.entity_manager.get_attribute(id,'blocking'):
-                # we are, let's check for entities on that spot, if they're blocking
-                for ent in self.entity_manager[(x+ex, y+ey)]:
-                    if self.entity_manager.get_attribute(ent,'blocking'):
-                        can_move = False
+                # we are, so blocking entities on that spot stop us too, as well as walls
+                if self.map.get_grid().get_blocking(x + ex, y + ey):
+                    can_move = False
+            # check for wall
+            elif self.map.get_blocking(x + ex, y + ey):
+                can_move = False
             return can_move
         else:
             return False
@@ -705,6 +796,17 @@ class Application(object):
         parents, names, meta, cur_id = self._inv_window_recurse(player,parents,names,meta)
         self.inv_win.set_nodes(parents,names,meta)
 
+    def update_minimap_window(self):
+        """Default implementation of minimap window updating, shows the current map and marks the camera.
+
+        Set minimap_win to a L{graphics.MinimapWindow} to use it.
+        """
+        if self.minimap_win is None or self.map is None or not isinstance(self.fov_map, fov.FovMap):
+            return
+        self.minimap_win.set_map(self.map, self.fov_map)
+        if self.camera:
+            self.minimap_win.set_marker(*self.entity_manager.get_abs_pos(self.camera))
+
     def update_game_window(self, fov_radius=10):
         """Default implementation of graphics updating, updates map and entities.
 
@@ -717,46 +819,56 @@ class Application(object):
             center_x, center_y = win.width/2, win.height/2
             offset_x, offset_y = camera_x - center_x, camera_y - center_y
 
-            # set up FOV map and compute FOV
+            # set up FOV map and compute FOV, reading transparency from one copy of the grid rows around the camera
             if self.fov_map:
                 self.fov_map.clear_light()
+                side = 2*fov_radius + 1
+                left, top = camera_x - fov_radius, camera_y - fov_radius
+                opaque = self.map.get_grid().get_light_rect(left, top, side, side)
                 fov.fieldOfView(camera_x, camera_y, self.map.width, self.map.height, fov_radius,
-                        self.fov_map.set_lit, self.map.get_blocking)
+                        self.fov_map.set_lit, lambda x, y: opaque[(y-top)*side + x-left])
 
             # make a list of the tiles to draw
             # tiles of the form [x, y, fgcol, string, bgcol, set_background]
             bg_tiles = [ ]
             ent_tiles = [ ]
-
-            for i in range(win.width):
-                for j in range(win.height):
-                    x, y = i + offset_x, j + offset_y
-
-                    lit = False
-                    explored = False
-                    if self.fov_map:
-                        lit = self.fov_map.get_lit(x, y)
-                        explored = self.fov_map.get_explored(x, y)
-                    blocks = self.map.get_blocking(x, y)
+            view = self.map.get_rect(offset_x, offset_y, win.width, win.height, view=True)
+            palette = self.map.palette
+            # the window's lit and explored state, and its entities by position, each gathered in one go
+            if self.fov_map:
+                lit_rect = self.fov_map.get_lit_rect(offset_x, offset_y, win.width, win.height)
+                explored_rect = self.fov_map.get_explored_rect(offset_x, offset_y, win.width, win.height)
+            else:
+                lit_rect = explored_rect = bytearray(win.width * win.height)
+            ents_at = { }
+            for id, pos in self.entity_manager.positions.iteritems():
+                if pos is not None and offset_x <= pos[0] < offset_x + win.width and offset_y <= pos[1] < offset_y + win.height:
+                    ents_at.setdefault(tuple(pos), [ ]).append(id)
+
+            for j in range(win.height):
+                row = bytearray(chr(material.WALL) * win.width)
+                start, ids = view.get_row(j)
+                row[start:start+len(ids)] = ids
+                for i in range(win.width):
+                    lit = lit_rect[j*win.width + i]
+                    explored = explored_rect[j*win.width + i]
+                    mat = palette[row[i]]
+                    blocks = mat.blocks
+                    col = mat.fgcol or (self.wall_col if blocks else self.floor_col)
 
                     if lit:
-                        if not blocks:
-                            bg_tiles.append([i, j, self.floor_col, 'floor', None, 1])
-                        else:
-                            bg_tiles.append([i, j, self.wall_col, 'wall', None, 1])
+                        bg_tiles.append([i, j, col, mat.glyph, mat.bgcol, 1])
                     else:
                         if not blocks and explored:
-                            bg_tiles.append([i, j, self.floor_col, 'dark_floor', None, 1])
+                            bg_tiles.append([i, j, col, mat.dark_glyph, mat.bgcol, 1])
                         else:
                             bg_tiles.append([i, j, self.wall_col, 'dark_wall', None, 1])
 
-                    ents = self.entity_manager[(x, y)]
-                    for ent in ents:
-                        if lit and self.entity_manager.get_attribute(ent, 'visible'):
-                            bg = 'floor'
-                            if blocks:
-                                bg = 'wall'
-                            ent_tiles.append([i, j, bg, self.entity_manager[ent].char, None, 1])
+                    if lit and (i + offset_x, j + offset_y) in ents_at:
+                        for ent in ents_at[i + offset_x, j + offset_y]:
+                            if self.entity_manager.get_attribute(ent, 'visible'):
+                                bg = mat.glyph
+                                ent_tiles.append([i, j, bg, self.entity_manager[ent].char, None, 1])
             win.update_layer(0,bg_tiles)
             win.update_layer(1,ent_tiles)
 
@@ -767,16 +879,113 @@ class Application(object):
         Subclass and replace to add code to run every working update, or drawing calls.
         """
 
+        if self.real_time is not None:
+            self.update_real_time()
+            return
+
         if self.time_passing:
-            self.scheduler.tick()
-        self.time_passing = False
+            # a tick cut short by its budget carries on next update
+            self.time_passing = not self.scheduler.tick()
+        if self.world is not None:
+            self.world.update()
         self.update_game_window()
         self.update_inv_window()
+        self.update_minimap_window()
         self.win_man.draw_all()
 
         #input
         self.keyboard.tick()
 
+    def update_real_time(self):
+        """Update function used instead of L{update}'s turn-based one in real-time mode.
+
+        Runs the ticks the fixed timestep owes, draws if a frame is due, then handles whatever input is queued and
+        sleeps until the next tick or frame. Input never waits for a key press here, so the world keeps moving while
+        the player is idle.
+        """
+        steps = self.real_time.get_steps()
+        if steps:
+            self.scheduler.advance(steps)
+            if self.world is not None:
+                self.world.update()
+        if self.real_time.get_render():
+            self.update_game_window()
+            self.update_inv_window()
+            self.update_minimap_window()
+            self.win_man.draw_all()
+
+        #input
+        self.keyboard.tick(False)
+        self.scheduler.sleep(self.real_time.get_idle())
+
+    def enable_real_time(self, rate, max_steps=5, render_rate=None):
+        """Switches to real-time mode, where scheduler ticks follow the wall clock instead of the player's turns.
+
+        @type  rate: number
+        @param rate: Scheduler ticks per second.
+        @type  max_steps: number
+        @param max_steps: Most ticks to catch up on in a single update after a slow frame.
+        @type  render_rate: number
+        @param render_rate: Frames drawn per second, or None to draw on every update.
+        """
+        self.real_time = time.FixedStep(rate, max_steps, render_rate, self.scheduler.clock)
+
+    def disable_real_time(self):
+        """Switches back to turn-based mode."""
+        self.real_time = None
+
+    def set_tick_budget(self, tasks=None, seconds=None):
+        """Bounds the work done by one scheduler tick, so that a frame never freezes under heavy load.
+
+        A tick that runs out of budget carries on in the next L{update}.
+
+        @type  tasks: number
+        @param tasks: Maximum number of tasks to run per tick, or None for no limit.
+        @type  seconds: number
+        @param seconds: Maximum wall-clock time per tick, or None for no limit.
+        """
+        self.tick_budget = (tasks, seconds)
+        self.scheduler.set_budget(tasks, seconds)
+
+    def simulate(self, ticks):
+        """Advances the world by a number of ticks, with no rendering and no waiting for input.
+
+        Every entity due in that time runs, the player included, whether or not it is the dominant task. Useful for
+        warming up a freshly generated level or for soak runs.
+
+        @type  ticks: number
+        @param ticks: Number of ticks to advance.
+        @rtype: number
+        @return: Simulation speed, in ticks per second.
+        """
+        start = self.scheduler.clock()
+        self.scheduler.advance(ticks)
+        elapsed = self.scheduler.clock() - start
+        if not elapsed:
+            return float(ticks)
+        return ticks / elapsed
+
+    def run_until(self, predicate, ticks=None):
+        """Advances the world until predicate returns True, with no rendering and no waiting for input.
+
+        Predicate is called with no arguments before every tick that has anything to run.
+
+        @type  predicate: function
+        @param predicate: Function that returns True when the simulation should stop.
+        @type  ticks: number
+        @param ticks: Maximum number of ticks to advance, or None for no limit.
+        @rtype: number
+        @return: Number of ticks advanced.
+        """
+        start = self.scheduler.ticks
+        limit = None
+        if ticks is not None:
+            limit = start + ticks
+        while not predicate():
+            if not self.scheduler.step(limit):
+                break
+        return self.scheduler.ticks - start
+
     def quit(self):
         """Exit application."""
         self.exit = 1
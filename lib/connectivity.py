@@ -0,0 +1,143 @@
+import bisect
+import re
+
+# Connectivity labels the 4-connected areas of walkable tiles of a map. Each row is kept as sorted lists of its walkable
+# runs' starts, ends and labels, and labels are merged with union-find, so two tiles are connected when the roots of
+# their runs' labels match. Memory follows the number of runs, not the size of the map.
+#
+# Walls written over walkable tiles can split an area, which union-find can't undo; They mark the labels dirty, and
+# they're rebuilt on the next query. Single walkable tiles are added in place.
+
+
+class Connectivity(object):
+    """Connected areas of a map's walkable tiles; Use L{lib.map.Map.get_connectivity} to get one kept up to date."""
+
+    def __init__(self, map):
+        self.map = map
+        self.rows = None
+        self.parent = [ ]
+        self.dirty = True
+
+    def find(self, label):
+        """Returns the root label of the area a label belongs to."""
+        parent = self.parent
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:
+            parent[label], label = root, parent[label]
+        return root
+
+    def union(self, a, b):
+        """Merges the areas of two labels."""
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def new_label(self):
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def rebuild(self):
+        """Labels the whole map, one row of runs at a time."""
+        palette = self.map.palette
+        table = bytearray(256)
+        for id in range(256):
+            table[id] = not palette.blocks[id]
+        view = self.map.get_tiles(view=True)
+        self.rows = [ ]
+        self.parent = [ ]
+        above = ([ ], [ ], [ ])
+        for j in range(self.map.height):
+            start, ids = view.get_row(j)
+            starts, ends, labels = [ ], [ ], [ ]
+            k = 0
+            for run in re.finditer('\x01+', str(bytearray(ids).translate(table))):
+                a, b = run.start() + start, run.end() + start
+                label = None
+                # join every run of the row above that overlaps this one
+                while k < len(above[0]) and above[1][k] <= a:
+                    k += 1
+                i = k
+                while i < len(above[0]) and above[0][i] < b:
+                    if label is None:
+                        label = self.find(above[2][i])
+                    else:
+                        self.union(label, above[2][i])
+                    i += 1
+                if i > k:
+                    k = i - 1
+                if label is None:
+                    label = self.new_label()
+                starts.append(a)
+                ends.append(b)
+                labels.append(label)
+            self.rows.append((starts, ends, labels))
+            above = (starts, ends, labels)
+        self.dirty = False
+
+    def get_run(self, x, y):
+        """Returns the index of the run holding (x,y) in its row, or None if the tile isn't walkable."""
+        if not 0 <= y < len(self.rows):
+            return None
+        starts, ends, labels = self.rows[y]
+        i = bisect.bisect_right(starts, x) - 1
+        if i >= 0 and x < ends[i]:
+            return i
+        return None
+
+    def get_label(self, x, y):
+        """Returns the label of the area (x,y) is in, or None if it isn't walkable."""
+        if self.dirty:
+            self.rebuild()
+        i = self.get_run(x, y)
+        if i is None:
+            return None
+        return self.find(self.rows[y][2][i])
+
+    def is_reachable(self, a, b):
+        """Returns True if there's a walkable 4-connected path between positions a and b."""
+        label = self.get_label(*a)
+        return label is not None and label == self.get_label(*b)
+
+    def update(self, x, y, w, h):
+        """Takes note of a change to the (w,h) area at (x,y) of the map."""
+        if self.dirty:
+            return
+        if w != 1 or h != 1 or not 0 <= y < len(self.rows):
+            self.dirty = True
+            return
+        walkable = not self.map.get_blocking(x, y)
+        i = self.get_run(x, y)
+        if i is not None:
+            if not walkable:
+                self.dirty = True
+            return
+        if not walkable:
+            return
+        starts, ends, labels = self.rows[y]
+        i = bisect.bisect_right(starts, x)
+        joins_left = i > 0 and ends[i-1] == x
+        joins_right = i < len(starts) and starts[i] == x+1
+        if joins_left and joins_right:
+            self.union(labels[i-1], labels[i])
+            ends[i-1] = ends[i]
+            del starts[i], ends[i], labels[i]
+            label = labels[i-1]
+        elif joins_left:
+            ends[i-1] = x+1
+            label = labels[i-1]
+        elif joins_right:
+            starts[i] = x
+            label = labels[i]
+        else:
+            label = self.new_label()
+            starts.insert(i, x)
+            ends.insert(i, x+1)
+            labels.insert(i, label)
+        for near in (y-1, y+1):
+            if 0 <= near < len(self.rows):
+                k = self.get_run(x, near)
+                if k is not None:
+                    self.union(label, self.rows[near][2][k])
@@ -1,4 +1,4 @@
-from data.entities import Lookup
+from data.entities import Lookup, Entity
 
 class EntityManager(object):
     """Manager class for Entities.
@@ -8,6 +8,9 @@ class EntityManager(object):
     positions contains the position of the entity, or None.
     parents contains the ID of the containing entity, or None.
     schedules contains the IDs of the scheduling tasks assigned to each entity.
+    acting caches, per class, whether it overrides Entity.update; Entities that don't never enter the scheduler.
+    reserved contains IDs held by entities stored away, which aren't handed out to new entities.
+    grid is the current map's Grid, kept up to date with where blocking and opaque entities are, or None.
     cur_id is the current free ID to be assigned.
     Entity ID #0 is 'garbage collection' of entities. Parent to this to remove next tick.
     """
@@ -18,6 +21,9 @@ class EntityManager(object):
         self.positions = { }
         self.parents = { }
         self.schedules = { }
+        self.acting = { }
+        self.reserved = set()
+        self.grid = None
         self.parent = parent
         self.scheduler = parent.scheduler
 
@@ -45,15 +51,26 @@ class EntityManager(object):
     def is_instance(self, id, lookup):
         return isinstance(self[id], self.class_lookup.get_class(lookup))
 
+    def get_rng(self, name):
+        """Convenience method for entities to get a named random stream from the application."""
+        return self.parent.rng[name]
+
     def post_message(self, msg):
         """Convenience method for entities to call to post messages to the message window."""
         self.parent.add_messages((msg,))
 
+    def is_acting(self, cls):
+        """Returns True if instances of cls do anything on update."""
+        if cls not in self.acting:
+            self.acting[cls] = cls.update.im_func is not Entity.update.im_func
+        return self.acting[cls]
+
     def add_entity(self, type, delay=10):
         """Adds a new entity of type to entity_list, and returns its ID."""
         self.adjust_cur_id()
         id = self.cur_id
         cls = self.class_lookup.get_class(type)
+        self.is_acting(cls)
         self.lookup[id] = cls(self,id)
         self.lookup[id].init()
         self.lookup[id].type = type
@@ -79,6 +96,64 @@ class EntityManager(object):
         if delay is not None:
             self.schedule(self.scheduler, id)
 
+    def remove_entity(self, id):
+        """Removes an entity from the manager and the scheduler; Entities it contains keep it as their parent."""
+        if id not in self:
+            raise IDNotFound
+        self.set_sched(id, None)
+        del self.schedules[id]
+        self.move_in_grid(id, None)
+        del self.lookup[id]
+        self.positions.pop(id, None)
+        self.parents.pop(id, None)
+
+    def get_record(self, id):
+        """Returns a dict of the entity's save-format data, which L{load_record} turns back into an entity."""
+        obj = self[id]
+        return {"type": obj.type, "pos": self.positions.get(id), "parent": self.parents.get(id),
+                "atts": obj.get_attributes(), "name": obj.name, "char": obj.char, "delay": obj.delay or None,
+                "fgcol": list(obj.fgcol)}
+
+    def load_record(self, id, record):
+        """Loads an entity with the given ID from a dict made by L{get_record}."""
+        pos = record["pos"]
+        if pos is not None:
+            pos = tuple(pos)
+        self.load_entity(id, record["type"], pos, record["parent"], record["atts"], record["name"],
+                record["char"], record["delay"], record["fgcol"])
+
+    def set_grid(self, grid):
+        """Sets the grid blocking and opaque entities are counted in, and counts them all; None for no grid."""
+        self.grid = grid
+        if grid is not None:
+            grid.set_entities(self)
+
+    def move_in_grid(self, id, pos):
+        """Moves an entity's count in the grid from its current position to pos, which is None if it leaves the map."""
+        if self.grid is None or id not in self.lookup:
+            return
+        blocking = self.lookup[id].get_attribute('blocking')
+        opaque = self.lookup[id].get_attribute('opaque')
+        if blocking or opaque:
+            old = self.positions.get(id)
+            if old is not None:
+                self.grid.remove(old, blocking, opaque)
+            if pos is not None:
+                self.grid.add(pos, blocking, opaque)
+
+    def attribute_changed(self, id, att, old):
+        """Called by entities after one of their attributes changes; Keeps the grid up to date."""
+        if self.grid is None or att not in ('blocking', 'opaque'):
+            return
+        pos = self.positions.get(id)
+        if pos is not None:
+            if att == 'blocking':
+                self.grid.remove(pos, old, 0)
+                self.grid.add(pos, self.lookup[id].get_attribute(att), 0)
+            else:
+                self.grid.remove(pos, 0, old)
+                self.grid.add(pos, 0, self.lookup[id].get_attribute(att))
+
     def get_at(self,x,y):
         """Returns list of ids of entities at a position or an empty tuple."""
         if (x,y) in self.positions.itervalues():
@@ -151,8 +226,8 @@ class EntityManager(object):
     def set_sched(self, ent, sched):
         """Cancels the current schedule for an entity and sets a new id as its main."""
         if ent in self.schedules:
-            if self.schedules[ent] is not None:
-                sched.cancel_schedule(self.schedules[ent])
+            if self.schedules[ent] is not None and self.schedules[ent] != sched:
+                self.scheduler.cancel_schedule(self.schedules[ent])
         self.schedules[ent] = sched
 
     def get_sched(self, ent):
@@ -162,15 +237,26 @@ class EntityManager(object):
         return None
 
     def schedule(self, sched, id):
-        """Schedules the entity in the scheduler according to its current delay."""
-        if id in self.schedules:
-            if self.schedules[id] is not None:
-                sched.cancel_schedule(self.schedules[id])
+        """Schedules the entity in the scheduler according to its current delay.
+
+        An entity that is already scheduled keeps its scheduler id, and is only moved to its new delay. Entities whose
+        class doesn't override update are left out, whatever their delay.
+        """
         if id not in self:
             raise IDNotFound
         delay = self[id].delay
+        if not self.is_acting(self[id].__class__):
+            delay = None
+        current = self.schedules.get(id)
+        if current is not None and sched.get_schedule(current) is not None:
+            if delay is not None:
+                sched.reschedule(current, delay)
+                return
+            sched.cancel_schedule(current)
         if delay is not None:
             self.schedules[id] = sched.add_schedule((self[id].update, (), delay))
+        else:
+            self.schedules[id] = None
 
 
     def ent_lift(self, ent1, ent2):
@@ -244,6 +330,7 @@ class EntityManager(object):
         """Sets the entity's position to the given tuple, unsetting parent."""
         #if id not in self:
         #    raise IDNotFound
+        self.move_in_grid(id, pos)
         self.positions[id] = pos
         self.parents[id] = None
 
@@ -251,12 +338,13 @@ class EntityManager(object):
         """Sets the entity's containing entity to the given ID, unsetting its position."""
         #if id not in self and parent_id not in self:
         #    raise IDNotFound
+        self.move_in_grid(id, None)
         self.positions[id] = None
         self.parents[id] = parent_id
 
     def adjust_cur_id(self):
         self.cur_id = 0
-        while self.cur_id in self.lookup:
+        while self.cur_id in self.lookup or self.cur_id in self.reserved:
             self.cur_id += 1
 
     def save(self):
@@ -17,6 +17,8 @@
 #    FovMap is not included under this notice, as it is pYendor-specific.
 
 import copy
+import zlib
+import base64
 
 def fieldOfView(startX, startY, mapWidth, mapHeight, radius,
                 funcVisitTile, funcTileBlocked):
@@ -327,35 +329,224 @@ def __checkView(activeViews, viewIndex):
 
 
 class FovMap(object):
+    """Explored and lit state of a map's tiles.
+
+    Both are flat bytearray planes in row order, holding 1 for explored or lit tiles; Tile (x,y) is at y*w + x. The
+    tiles lit since the last clear_light are remembered, so it only has to zero those, in place.
+
+    version is bumped whenever tiles become explored, and row_versions keeps the version of the last change to each
+    row, so that views of the explored state like L{lib.minimap.Minimap} can tell which rows to look at again.
+    """
 
     def __init__(self, w, h):
         self.w = w
         self.h = h
-        self.map = [
-            [0 for i in range(self.h)] for j in range(self.w)
-        ]
-        self.clear_light()
+        self.map = bytearray(w * h)
+        self.light_map = bytearray(w * h)
+        # indices of the tiles lit since the last clear_light
+        self.lit = [ ]
+        self.init_versions()
+
+    def init_versions(self):
+        self.version = 0
+        self.row_versions = [0] * self.h
+
+    def _explored(self, y, h=1):
+        """Called after tiles in the h rows from y on become explored."""
+        self.version += 1
+        y0, y1 = max(y, 0), min(y + h, self.h)
+        self.row_versions[y0:y1] = [self.version] * max(y1 - y0, 0)
+
+    def clear_light(self):
+        light_map = self.light_map
+        for i in self.lit:
+            light_map[i] = 0
+        del self.lit[:]
+
+    def get_explored(self, x, y):
+        if 0 < x < self.w and 0 < y < self.h:
+            return self.map[y*self.w + x]
+        return 0
+
+    def set_explored(self, x, y):
+        if 0 < x < self.w and 0 < y < self.h and not self.map[y*self.w + x]:
+            self.map[y*self.w + x] = 1
+            self._explored(y)
+
+    def set_lit(self, x, y):
+        if 0 < x < self.w and 0 < y < self.h:
+            i = y*self.w + x
+            if not self.light_map[i]:
+                self.light_map[i] = 1
+                self.lit.append(i)
+            if not self.map[i]:
+                self.map[i] = 1
+                self._explored(y)
+
+    def get_lit(self, x, y):
+        if 0 < x < self.w and 0 < y < self.h:
+            return self.light_map[y*self.w + x]
+        return 0
+
+    def get_explored_rect(self, x, y, w, h):
+        """Returns the explored state of the (w,h) area starting at (x,y) as a bytearray of its rows; 0 off the map."""
+        return self._get_rect(self.map, x, y, w, h)
+
+    def get_lit_rect(self, x, y, w, h):
+        """Returns the lit state of the (w,h) area starting at (x,y) as a bytearray of its rows; 0 off the map."""
+        return self._get_rect(self.light_map, x, y, w, h)
+
+    def _get_rect(self, plane, x, y, w, h):
+        if x == 0 and w == self.w and 0 <= y and y + h <= self.h:
+            return plane[y*w:(y+h)*w]
+        ret = bytearray(w * h)
+        x0, x1 = max(x, 0), min(x + w, self.w)
+        if x0 < x1:
+            for j in range(max(y, 0), min(y + h, self.h)):
+                k = (j-y)*w + x0-x
+                ret[k:k + x1-x0] = plane[j*self.w + x0:j*self.w + x1]
+        return ret
+
+    def save(self):
+        """Returns the explored state as a dict for JSON; See L{load_fov_map}."""
+        return {"explored": base64.b64encode(zlib.compress(str(self.map)))}
+
+    def load(self, data):
+        """Loads the explored state from data made by L{save}."""
+        self.map[:] = zlib.decompress(base64.b64decode(data["explored"]))
+        self._explored(0, self.h)
+
+
+class ChunkedFovMap(FovMap):
+    """Explored and lit state of a L{lib.map.ChunkedMap}'s tiles, in chunks matching the map's.
+
+    Chunks are only allocated once a tile in them is explored or lit. L{get_chunk} and L{set_chunk} let explored chunks
+    be stored away and brought back along with the map's. Lit chunks last until the clear_light after the one they were
+    last lit before, and are zeroed in place in between, so they only cover the area around the viewer.
+    """
+
+    def __init__(self, w, h, chunk_bits=5):
+        self.w = w
+        self.h = h
+        self.chunk_bits = chunk_bits
+        self.chunk_mask = (1 << chunk_bits) - 1
+        self.chunk_area = 1 << (2 * chunk_bits)
+        self.dark = bytearray(self.chunk_area)
+        # explored chunks, and lit chunks with the ones lit before the last clear_light, which are dark
+        self.chunks = { }
+        self.light_chunks = { }
+        self.spare = { }
+        self.init_versions()
 
     def clear_light(self):
-        self.light_map = [
-            [0 for i in range(self.h)] for j in range(self.w)
-        ]
+        for chunk in self.light_chunks.itervalues():
+            chunk[:] = self.dark
+        self.spare.clear()
+        self.spare, self.light_chunks = self.light_chunks, self.spare
+
+    def get_chunk(self, cx, cy):
+        """Returns the explored plane of chunk (cx,cy); None if nothing in it is explored."""
+        return self.chunks.get((cx, cy))
+
+    def set_chunk(self, cx, cy, chunk):
+        """Puts an explored plane in place as chunk (cx,cy), or drops it if chunk is None; Returns the plane replaced.
+
+        The chunk's lit state is dropped either way.
+        """
+        self.light_chunks.pop((cx, cy), None)
+        self.spare.pop((cx, cy), None)
+        old = self.chunks.pop((cx, cy), None)
+        if chunk is not None:
+            self.chunks[cx, cy] = chunk
+        if old is not None or chunk is not None:
+            self._explored(cy << self.chunk_bits, 1 << self.chunk_bits)
+        return old
 
     def get_explored(self, x, y):
         if 0 < x < self.w and 0 < y < self.h:
-            return self.map[x][y]
+            chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+            if chunk is not None:
+                return chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
         return 0
 
     def set_explored(self, x, y):
         if 0 < x < self.w and 0 < y < self.h:
-            self.map[x][y] = 1
+            key = (x >> self.chunk_bits, y >> self.chunk_bits)
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.chunks[key] = bytearray(self.chunk_area)
+            i = ((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)
+            if not chunk[i]:
+                chunk[i] = 1
+                self._explored(y)
 
     def set_lit(self, x, y):
         if 0 < x < self.w and 0 < y < self.h:
-            self.light_map[x][y] = 1
-            self.set_explored(x, y)
+            key = (x >> self.chunk_bits, y >> self.chunk_bits)
+            light = self.light_chunks.get(key)
+            if light is None:
+                light = self.light_chunks[key] = self.spare.pop(key, None) or bytearray(self.chunk_area)
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.chunks[key] = bytearray(self.chunk_area)
+            i = ((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)
+            light[i] = 1
+            if not chunk[i]:
+                chunk[i] = 1
+                self._explored(y)
 
     def get_lit(self, x, y):
         if 0 < x < self.w and 0 < y < self.h:
-            return self.light_map[x][y]
-        return 0
\ No newline at end of file
+            chunk = self.light_chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+            if chunk is not None:
+                return chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
+        return 0
+
+    def get_explored_rect(self, x, y, w, h):
+        """Returns the explored state of the (w,h) area starting at (x,y) as a bytearray of its rows; 0 off the map."""
+        return self._get_rect(self.chunks, x, y, w, h)
+
+    def get_lit_rect(self, x, y, w, h):
+        """Returns the lit state of the (w,h) area starting at (x,y) as a bytearray of its rows; 0 off the map."""
+        return self._get_rect(self.light_chunks, x, y, w, h)
+
+    def _get_rect(self, chunks, x, y, w, h):
+        bits = self.chunk_bits
+        mask = self.chunk_mask
+        ret = bytearray(w * h)
+        x0, x1 = max(x, 0), min(x + w, self.w)
+        for j in range(max(y, 0), min(y + h, self.h)):
+            base = (j & mask) << bits
+            a = x0
+            while a < x1:
+                b = min(x1, (a | mask) + 1)
+                chunk = chunks.get((a >> bits, j >> bits))
+                if chunk is not None:
+                    k = (j-y)*w + a-x
+                    ret[k:k + b-a] = chunk[base + (a & mask):base + (a & mask) + b-a]
+                a = b
+        return ret
+
+    def save(self):
+        """Returns the explored state as a dict for JSON; See L{load_fov_map}."""
+        chunks = { }
+        for cx, cy in self.chunks:
+            chunks['{0},{1}'.format(cx, cy)] = base64.b64encode(zlib.compress(str(self.chunks[cx, cy])))
+        return {"chunk_bits": self.chunk_bits, "chunks": chunks}
+
+    def load(self, data):
+        """Loads the explored state from data made by L{save}."""
+        for key in data["chunks"]:
+            cx, cy = key.split(",",1)
+            self.chunks[int(cx), int(cy)] = bytearray(zlib.decompress(base64.b64decode(data["chunks"][key])))
+        self._explored(0, self.h)
+
+
+def load_fov_map(data, w, h):
+    """Returns a FovMap of size (w,h) made from data, as produced by L{FovMap.save} or L{ChunkedFovMap.save}."""
+    if "chunks" in data:
+        fov_map = ChunkedFovMap(w, h, data["chunk_bits"])
+    else:
+        fov_map = FovMap(w, h)
+    fov_map.load(data)
+    return fov_map
@@ -1,10 +1,13 @@
 import struct
 import data.libtctrout as libtctrout
+import lib.minimap as minimap
 
 #    Window
 #    |
 #    +-LayeredGameWindow
 #    |
+#    +-MinimapWindow
+#    |
 #    +-MessageWindow
 #       |
 #       +-ChoiceWindow
@@ -483,6 +486,75 @@ class LayeredGameWindow(Window):
         self.restore_border()
 
 
+class MinimapWindow(Window):
+    """Overview of the whole map, drawn a cell per square of tiles inside the border.
+
+    Floor cells take the foreground colour, explored wall cells wall_col, and the rest the background colour. Only
+    the rows of cells that changed since the last update are redrawn; See L{lib.minimap.Minimap}.
+    """
+
+    def __init__(self,w,h,parent):
+        """Initialisation method."""
+        super(MinimapWindow,self).__init__(w,h,parent)
+        self.wall_col = (125,125,125)
+        self.marker_char = '@'
+        self.minimap = None
+        # cell the marker is drawn in, and the cell it should move to
+        self.marker = None
+        self.new_marker = None
+        self.redraw = True
+
+    def set_map(self,map,fov_map):
+        """Shows a map and the explored state in its FovMap; Does nothing if they're already shown."""
+        if self.minimap is not None:
+            if self.minimap.map is map and self.minimap.fov_map is fov_map:
+                return
+            self.minimap.close()
+        self.minimap = minimap.Minimap(map, fov_map, self.width-2, self.height-2)
+        self.clear()
+
+    def set_marker(self,x,y):
+        """Marks the cell holding map tile (x,y), usually the camera's position."""
+        if self.minimap is not None:
+            self.new_marker = self.minimap.get_pos(x, y)
+
+    def draw_cell(self,x,y):
+        """Draws a single cell, with the marker if it's in it."""
+        cell = self.minimap.get_cell(x, y)
+        if cell == minimap.FLOOR:
+            col = self.fgcol
+        elif cell == minimap.WALL:
+            col = self.wall_col
+        else:
+            col = self.bgcol
+        char = ' '
+        if (x, y) == self.new_marker:
+            char = self.marker_char
+        self.specific_draw_char(x+1, y+1, char, convert(col), convert(self.bgcol), True)
+
+    def clear(self,bgcol = None, fgcol = None):
+        """Clear window; Every cell is drawn again on the next update."""
+        super(MinimapWindow,self).clear(bgcol,fgcol)
+        self.redraw = True
+
+    def update(self):
+        if self.minimap is None:
+            return
+        rows = self.minimap.update()
+        if self.redraw:
+            rows = range(self.minimap.height)
+            self.redraw = False
+        for j in rows:
+            for i in range(self.minimap.width):
+                self.draw_cell(i, j)
+        if self.marker != self.new_marker:
+            for cell in (self.marker, self.new_marker):
+                if cell is not None and cell[1] not in rows and 0 <= cell[0] < self.minimap.width and \
+                        0 <= cell[1] < self.minimap.height:
+                    self.draw_cell(*cell)
+            self.marker = self.new_marker
+
+
 class MessageWindow(Window):
     """Main messaging window type.
 
@@ -0,0 +1,241 @@
+import lib.material as material
+
+# Grid merges a map's tile flags with the entities standing on it, so that movement and sight can be checked with a
+# single lookup. Its planes are laid out like a Map's, border included, and hold 1 where a tile blocks.
+#
+# The map keeps the tile half up to date through its _changed hook; The EntityManager adds and removes blocking and
+# opaque entities as they move, appear, disappear or change attributes.
+#
+# A ChunkedMap gets a ChunkedGrid instead, whose planes are split into chunks like the map's. A grid chunk only exists
+# while the map's chunk does, so the grid takes memory for the carved area only.
+
+
+class Grid(object):
+    """Walkability and transparency of a map's tiles, with blocking and opaque entities taken into account."""
+
+    # True if the grid is kept in flat planes, which L{get_planes} returns; See L{lib.map.Map.has_plane}.
+    has_plane = True
+
+    def __init__(self, map):
+        """Initialisation method; Use L{lib.map.Map.get_grid} rather than creating grids directly."""
+        self.map = map
+        self.width = map.width
+        self.height = map.height
+        self.stride = map.width + 2
+        # counts of blocking and opaque entities per position
+        self.blocking = { }
+        self.opaque = { }
+        size = self.stride * (self.height+2)
+        self.blocks = bytearray('\x01' * size)
+        self.blocks_light = bytearray('\x01' * size)
+        self.update(-1, -1, self.width+2, self.height+2)
+
+    def get_blocking(self, x, y):
+        """Returns True if the tile or an entity on it is blocking."""
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            return self.blocks[(y+1)*self.stride + x+1]
+        return 1
+
+    def get_blocking_light(self, x, y):
+        """Returns True if the tile or an entity on it is blocking to light."""
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            return self.blocks_light[(y+1)*self.stride + x+1]
+        return 1
+
+    def get_light_rect(self, x, y, w, h):
+        """Returns blocks_light of the (w,h) area starting at (x,y) as a bytearray of its rows; 1 off the map."""
+        ret = bytearray('\x01' * (w * h))
+        x0, x1 = max(x, -1), min(x + w, self.width+1)
+        if x0 < x1:
+            for j in range(max(y, -1), min(y + h, self.height+1)):
+                k = (j-y)*w + x0-x
+                i = (j+1)*self.stride + x0+1
+                ret[k:k + x1-x0] = self.blocks_light[i:i + x1-x0]
+        return ret
+
+    def get_planes(self):
+        """Returns the blocks and blocks_light planes; Index them with L{lib.map.Map.get_index}.
+
+        None if the grid has no flat planes, see L{has_plane}.
+        """
+        return self.blocks, self.blocks_light
+
+    def update(self, x, y, w, h):
+        """Brings the (w,h) area starting at (x,y) up to date with the map and entity counts."""
+        palette = self.map.palette
+        if w == 1 and h == 1:
+            if -1 <= x <= self.width and -1 <= y <= self.height:
+                i = (y+1)*self.stride + x+1
+                id = self.map.get_material(x, y)
+                self.blocks[i] = int(palette.blocks[id] or (x, y) in self.blocking)
+                self.blocks_light[i] = int(palette.blocks_light[id] or (x, y) in self.opaque)
+            return
+        x0 = max(x, -1)
+        x1 = min(x + w, self.width+1)
+        if x0 >= x1:
+            return
+        for j in range(max(y, -1), min(y + h, self.height+1)):
+            start, ids = self.map.get_rect(x0, j, x1-x0, 1, view=True).get_row(0)
+            row = bytearray(chr(material.WALL) * (x1-x0))
+            row[start:start+len(ids)] = ids
+            i = (j+1)*self.stride + x0+1
+            self.blocks[i:i + x1-x0] = row.translate(palette.blocks)
+            self.blocks_light[i:i + x1-x0] = row.translate(palette.blocks_light)
+        self.apply_counts(x0, y, x1-x0, h)
+
+    def get_counted(self, counts, x, y, w, h):
+        """Returns the positions in the (w,h) area starting at (x,y) that are in a dict of counts."""
+        if w * h < len(counts):
+            return [(i, j) for i in range(x, x+w) for j in range(y, y+h) if (i, j) in counts]
+        return [pos for pos in counts if x <= pos[0] < x+w and y <= pos[1] < y+h]
+
+    def apply_counts(self, x, y, w, h):
+        """Marks the tiles of the (w,h) area starting at (x,y) that have blocking or opaque entities on them."""
+        for counts, plane in ((self.blocking, self.blocks), (self.opaque, self.blocks_light)):
+            for i, j in self.get_counted(counts, x, y, w, h):
+                if -1 <= i <= self.width and -1 <= j <= self.height:
+                    plane[(j+1)*self.stride + i+1] = 1
+
+    def add(self, pos, blocking, opaque, count=1):
+        """Counts an entity at pos, if it's blocking or opaque; A count of -1 takes it away again."""
+        pos = tuple(pos)
+        for flag, counts in ((blocking, self.blocking), (opaque, self.opaque)):
+            if flag:
+                counts[pos] = counts.get(pos, 0) + count
+                if counts[pos] <= 0:
+                    del counts[pos]
+        if blocking or opaque:
+            self.update(pos[0], pos[1], 1, 1)
+
+    def remove(self, pos, blocking, opaque):
+        """Takes away an entity counted at pos."""
+        self.add(pos, blocking, opaque, -1)
+
+    def set_entities(self, entity_manager):
+        """Recounts every entity from an EntityManager."""
+        self.blocking = { }
+        self.opaque = { }
+        for id in entity_manager:
+            pos = entity_manager.positions.get(id)
+            if pos is not None:
+                ent = entity_manager[id]
+                for flag, counts in (('blocking', self.blocking), ('opaque', self.opaque)):
+                    if ent.get_attribute(flag):
+                        counts[tuple(pos)] = counts.get(tuple(pos), 0) + 1
+        self.update(-1, -1, self.width+2, self.height+2)
+
+
+class ChunkedGrid(Grid):
+    """A L{Grid} of a L{lib.map.ChunkedMap}, with its planes in chunks matching the map's.
+
+    Chunks are made when the map's chunk first shows up in a write, and dropped along with it. Missing chunks are all
+    wall, so every tile in them reads as blocking without being stored.
+    """
+
+    has_plane = False
+
+    def __init__(self, map):
+        """Initialisation method; Use L{lib.map.ChunkedMap.get_grid} rather than creating grids directly."""
+        self.map = map
+        self.width = map.width
+        self.height = map.height
+        self.chunk_bits = map.chunk_bits
+        self.chunk_mask = map.chunk_mask
+        # counts of blocking and opaque entities per position
+        self.blocking = { }
+        self.opaque = { }
+        # (blocks, blocks_light) planes of each chunk, laid out like the map's chunk planes
+        self.chunks = { }
+        self.update(-1, -1, self.width+2, self.height+2)
+
+    def get_chunk(self, x, y):
+        """Returns the (blocks, blocks_light) planes of the chunk holding (x,y); None if the map has no such chunk."""
+        return self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+
+    def get_blocking(self, x, y):
+        """Returns True if the tile or an entity on it is blocking."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return 1
+        return chunk[0][((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
+
+    def get_blocking_light(self, x, y):
+        """Returns True if the tile or an entity on it is blocking to light."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return 1
+        return chunk[1][((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
+
+    def get_light_rect(self, x, y, w, h):
+        """Returns blocks_light of the (w,h) area starting at (x,y) as a bytearray of its rows; 1 off the map."""
+        bits = self.chunk_bits
+        mask = self.chunk_mask
+        ret = bytearray('\x01' * (w * h))
+        for j in range(y, y + h):
+            base = (j & mask) << bits
+            a = x
+            while a < x + w:
+                b = min(x + w, (a | mask) + 1)
+                chunk = self.chunks.get((a >> bits, j >> bits))
+                if chunk is not None:
+                    k = (j-y)*w + a-x
+                    ret[k:k + b-a] = chunk[1][base + (a & mask):base + (a & mask) + b-a]
+                a = b
+        return ret
+
+    def get_planes(self):
+        """Returns None, as the planes are kept in chunks; See L{get_chunk}."""
+        return None
+
+    def update(self, x, y, w, h):
+        """Brings the (w,h) area starting at (x,y) up to date with the map and entity counts.
+
+        Chunks of the area the map has dropped are dropped too, and ones it has made are made whole.
+        """
+        if w <= 0 or h <= 0:
+            return
+        bits = self.chunk_bits
+        mask = self.chunk_mask
+        palette = self.map.palette
+        tiles = self.map.chunks
+        if w == 1 and h == 1:
+            chunk = self.chunks.get((x >> bits, y >> bits))
+            if chunk is not None and (x >> bits, y >> bits) in tiles:
+                i = ((y & mask) << bits) + (x & mask)
+                id = tiles[x >> bits, y >> bits][i]
+                chunk[0][i] = int(palette.blocks[id] or (x, y) in self.blocking)
+                chunk[1][i] = int(palette.blocks_light[id] or (x, y) in self.opaque)
+                return
+        x0, y0, x1, y1 = x >> bits, y >> bits, (x + w - 1) >> bits, (y + h - 1) >> bits
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(tiles) + len(self.chunks):
+            keys = [key for key in set(tiles).union(self.chunks) if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+        else:
+            keys = [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+        size = mask + 1
+        for key in keys:
+            plane = tiles.get(key)
+            if plane is None:
+                self.chunks.pop(key, None)
+                continue
+            ox, oy = key[0] << bits, key[1] << bits
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                self.chunks[key] = plane.translate(palette.blocks), plane.translate(palette.blocks_light)
+                self.apply_counts(ox, oy, size, size)
+                continue
+            a, b = max(x, ox) - ox, min(x + w, ox + size) - ox
+            for j in range(max(y, oy) - oy, min(y + h, oy + size) - oy):
+                row = plane[(j << bits) + a:(j << bits) + b]
+                chunk[0][(j << bits) + a:(j << bits) + b] = row.translate(palette.blocks)
+                chunk[1][(j << bits) + a:(j << bits) + b] = row.translate(palette.blocks_light)
+            self.apply_counts(ox + a, max(y, oy), b - a, min(y + h, oy + size) - max(y, oy))
+
+    def apply_counts(self, x, y, w, h):
+        """Marks the tiles of the (w,h) area starting at (x,y) that have blocking or opaque entities on them."""
+        bits = self.chunk_bits
+        mask = self.chunk_mask
+        for counts, n in ((self.blocking, 0), (self.opaque, 1)):
+            for i, j in self.get_counted(counts, x, y, w, h):
+                chunk = self.chunks.get((i >> bits, j >> bits))
+                if chunk is not None:
+                    chunk[n][((j & mask) << bits) + (i & mask)] = 1
@@ -176,13 +176,17 @@ class KeyboardListener:
         self.bindings = dict()
         self.default = None
 
-    def tick(self):
+    def tick(self, wait=True):
         """Tick and run the bindings for the next keypress event.
 
-        For the binding (fct, (p1, p2, p3, ...)), fct gets called with p1, p2, p3, ... as parameters.
+        For the binding (fct, (p1, p2, p3, ...)), fct gets called with p1, p2, p3, ... as parameters. With wait set to
+        False, only the key presses already queued are handled, and it returns at once if there are none.
         """
 
-        keys = libtctrout.get_key()
+        if wait:
+            keys = libtctrout.get_key()
+        else:
+            keys = libtctrout.poll_key()
         for key in keys:
             vk = key.key
             if vk in self.bindings:
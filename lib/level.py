@@ -0,0 +1,217 @@
+import os
+import json
+import zlib
+import shutil
+import tempfile
+import collections
+
+import lib.map as map
+import lib.fov as fov
+
+# A level is a map, its explored FovMap, and the entities on it. The active level lives in the Application as usual;
+# LevelStack keeps the others. Entities of an inactive level are stored as save-format records, and their IDs stay
+# reserved in the EntityManager so they come back unchanged. The player, the camera, and everything they contain travel
+# with the player instead.
+
+
+class Level(object):
+    """An inactive level; Either loaded, holding its map and FovMap in memory, or spilled to a file."""
+
+    def __init__(self, name, map, fov_map, ents):
+        """Initialisation method.
+
+        @type  name: str
+        @param name: Name of the level.
+        @type  map: L{lib.map.Map}
+        @param map: The level's map.
+        @type  fov_map: L{lib.fov.FovMap}
+        @param fov_map: The level's explored state, or whatever the Application's fov_map was set to.
+        @type  ents: dict
+        @param ents: Dict of ID to entity record, from L{lib.entity_manager.EntityManager.get_record}.
+        """
+        self.name = name
+        self.map = map
+        self.fov_map = fov_map
+        self.ents = ents
+        self.ids = set(ents)
+        self.path = None
+
+    def is_loaded(self):
+        """Returns True if the level is in memory."""
+        return self.map is not None
+
+    def get_data(self):
+        """Returns a dict of the level in save format, ready for JSON; A spilled level's is read from its file."""
+        if not self.is_loaded():
+            with open(self.path, 'rb') as f:
+                return json.loads(zlib.decompress(f.read()))
+        lines = self.map.save()
+        lines[-1] = lines[-1][:-1]
+        data = {"map": json.loads("\n".join(lines)), "ents": self.ents}
+        if isinstance(self.fov_map, fov.FovMap):
+            data["explored"] = self.fov_map.save()
+        else:
+            data["fov"] = self.fov_map
+        return data
+
+    def spill(self, path, data=None):
+        """Writes the level to a compressed file at path, and drops it from memory.
+
+        @type  path: str
+        @param path: File to write.
+        @type  data: dict
+        @param data: The level in save format, as returned by L{get_data}; The level's own if None.
+        """
+        if data is None:
+            data = self.get_data()
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(data)))
+        if hasattr(self.map, 'close'):
+            self.map.close()
+        self.path = path
+        self.map = None
+        self.fov_map = None
+        self.ents = None
+
+    def load(self, map_class=None):
+        """Reads a spilled level back in, and removes its file."""
+        with open(self.path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+        self.map = map.load_map(data["map"], map_class)
+        if "explored" in data:
+            self.fov_map = fov.load_fov_map(data["explored"], self.map.width, self.map.height)
+        else:
+            self.fov_map = data["fov"]
+        self.ents = dict((int(id), record) for id, record in data["ents"].iteritems())
+        os.remove(self.path)
+        self.path = None
+
+
+class LevelStack(object):
+    """Keeps every level but the active one, the most recently left first to stay in memory.
+
+    At most max_loaded inactive levels are held in memory; Past that, the least recently used are spilled to files in
+    path, a temporary directory by default. Spilled levels cost nothing but their reserved entity IDs until entered.
+    """
+
+    def __init__(self, app, max_loaded=4, path=None):
+        """Initialisation method.
+
+        @type  app: L{lib.base.Application}
+        @param app: Application whose map and entities are swapped between levels.
+        @type  max_loaded: number
+        @param max_loaded: Most inactive levels kept in memory.
+        @type  path: str
+        @param path: Directory for spilled levels, or None for a temporary one.
+        """
+        self.app = app
+        self.max_loaded = max_loaded
+        self.path = path
+        self.temp_path = None
+        self.levels = collections.OrderedDict()
+        self.current = None
+        self.spilled = 0
+
+    def __contains__(self, name):
+        return name in self.levels
+
+    def __len__(self):
+        return len(self.levels)
+
+    def get_partition(self):
+        """Returns the IDs of the entities on the active level: All but the player, the camera, and their contents."""
+        entity_manager = self.app.entity_manager
+        travelling = set((entity_manager.garbage_id, self.app.player, self.app.camera))
+        ret = [ ]
+        for id in entity_manager:
+            if entity_manager.get_ancestor(id) not in travelling:
+                ret.append(id)
+        return ret
+
+    def store(self):
+        """Takes the active level out of the application and keeps it, spilling older levels if needed."""
+        if self.app.map is None:
+            return
+        entity_manager = self.app.entity_manager
+        ents = { }
+        for id in self.get_partition():
+            ents[id] = entity_manager.get_record(id)
+            entity_manager.remove_entity(id)
+        entity_manager.reserved.update(ents)
+        self.levels[self.current] = Level(self.current, self.app.map, self.app.fov_map, ents)
+        self.app.map = None
+        entity_manager.set_grid(None)
+        self.current = None
+        self.spill()
+
+    def enter(self, name):
+        """Stores the active level and makes name the active one; Returns False if it doesn't exist yet.
+
+        When False is returned, the application has no map, and the caller should make the new level's one.
+        """
+        self.store()
+        self.current = name
+        level = self.levels.pop(name, None)
+        if level is None:
+            return False
+        if not level.is_loaded():
+            level.load(self.app.map_type)
+        self.app.add_map(level.map)
+        if self.app.fov_map:
+            self.app.fov_map = level.fov_map
+        entity_manager = self.app.entity_manager
+        entity_manager.reserved.difference_update(level.ids)
+        for id in sorted(level.ents):
+            entity_manager.load_record(id, level.ents[id])
+        return True
+
+    def spill(self):
+        """Spills the least recently used levels until at most max_loaded are left in memory."""
+        loaded = [level for level in self.levels.itervalues() if level.is_loaded()]
+        for level in loaded[:max(0, len(loaded) - self.max_loaded)]:
+            self.spilled += 1
+            level.spill(os.path.join(self.get_path(), "{0}.level".format(self.spilled)))
+
+    def save(self):
+        """Returns a dict of every inactive level in save format, and the active one's name, ready for JSON."""
+        levels = [[level.name, level.get_data()] for level in self.levels.itervalues()]
+        return {"current": self.current, "levels": levels}
+
+    def load(self, data):
+        """Replaces every inactive level with those in data, as returned by L{save} and parsed from JSON.
+
+        Levels come back spilled, and are read in when entered.
+        """
+        self.clear()
+        entity_manager = self.app.entity_manager
+        for name, level_data in data["levels"]:
+            ents = dict((int(id), record) for id, record in level_data["ents"].iteritems())
+            level = Level(name, None, None, ents)
+            self.spilled += 1
+            level.spill(os.path.join(self.get_path(), "{0}.level".format(self.spilled)), level_data)
+            entity_manager.reserved.update(level.ids)
+            self.levels[name] = level
+        self.current = data["current"]
+
+    def get_path(self):
+        """Returns the directory spilled levels go in, creating it if needed."""
+        if self.path is not None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            return self.path
+        if self.temp_path is None:
+            self.temp_path = tempfile.mkdtemp(prefix='levels')
+        return self.temp_path
+
+    def clear(self):
+        """Forgets every inactive level, deleting spilled files."""
+        entity_manager = self.app.entity_manager
+        for level in self.levels.itervalues():
+            if level.path is not None:
+                os.remove(level.path)
+            entity_manager.reserved.difference_update(level.ids)
+        self.levels.clear()
+        self.current = None
+        if self.temp_path is not None:
+            shutil.rmtree(self.temp_path, True)
+            self.temp_path = None
@@ -3,25 +3,167 @@
 import random
 import ConfigParser
 import os
+import mmap
+import ctypes
+import struct
+import json
+import zlib
+import base64
+import re
+import bisect
+import cPickle
+
+import lib.material as material
+import lib.connectivity as connectivity
+import lib.grid as grid
 
 # Generator creates a map, then gen_map returns it.
 #
-# Map contains a basic 2D array of tuples of the form (blocks, blocks_light), for easy referencing.
+# Map stores tiles as a flat byte plane of material IDs, for fast referencing. See lib.material.
 #
-# Tile is (blocks, blocks_light).
+# Tile is (blocks, blocks_light), the flags of a tile's material.
 #
 # Globals _WALL and _FLOOR to ease modification.
 
 _WALL = (1,1)
 _FLOOR = (0,0)
 
+# The block library is compiled into a catalog, cached in _CATALOG_FILE, see _get_catalog.
+_CATALOG_FILE = 'data/map/blocks/catalog.cache'
+_catalog = None
+
+# side of a block facing each side of its neighbour
+_OPPOSITE = {"top": "bottom", "bottom": "top", "left": "right", "right": "left"}
+
+# translate table turning a block's lines into a stamp mask, with walls left out
+_BLOCK_MASK = ''.join(chr(c != ord('#')) for c in range(256))
+
+def _get_runs(mask):
+    """Returns the (start, end) spans of nonzero bytes in a row of a mask."""
+    return [run.span() for run in re.finditer('[^\x00]+', str(mask))]
+
+def load_map(data, map_class=None):
+    """Returns a map made from save format data, as produced by L{Map.save} and parsed from JSON.
+
+    Maps saved with a file are reopened as a L{MappedMap}, raising IOError if the file is gone; Others are made with
+    map_class, L{Map} by default.
+    """
+    if "file" in data:
+        new_map = MappedMap(*data["size"], path=data["file"], create=False)
+    else:
+        new_map = (map_class or Map)(*data["size"])
+    new_map.load(data)
+    return new_map
+
+def _get_saved_tiles(data, palette):
+    """Yields (x, y, material ID) for every tile but walls in save format data, of any map type."""
+    if "tiles" in data or "chunks" in data:
+        remap = palette.get_remap(data["materials"])
+    if "tiles" in data:
+        plane = bytearray(zlib.decompress(base64.b64decode(data["tiles"])))
+        stride = data["size"][0] + 2
+        for i in range(len(plane)):
+            if plane[i] != material.WALL:
+                yield i % stride - 1, i // stride - 1, remap[plane[i]] if remap else plane[i]
+    elif "chunks" in data:
+        bits = data["chunk_bits"]
+        mask = (1 << bits) - 1
+        for key in data["chunks"]:
+            cx, cy = key.split(",",1)
+            chunk = bytearray(zlib.decompress(base64.b64decode(data["chunks"][key])))
+            for i in range(len(chunk)):
+                if chunk[i] != material.WALL:
+                    id = remap[chunk[i]] if remap else chunk[i]
+                    yield (int(cx) << bits) + (i & mask), (int(cy) << bits) + (i >> bits), id
+    else:
+        # older saves list every tile but walls by position
+        for key in data:
+            if key not in ("size", "file", "materials"):
+                x, y = key.split(",",1)
+                yield int(x), int(y), palette.get_id_for(data[key])
+
+def _compile_block(path, id):
+    """Returns a dict of everything the generators use from a block file."""
+    parser = ConfigParser.RawConfigParser()
+    parser.read(path)
+    block = {"width": parser.getint(id,'width'), "height": parser.getint(id,'height'), "dirs": [ ], "walls": [ ],
+             "spawners": { }}
+    for dir in ('top', 'bottom', 'left', 'right'):
+        s = parser.get(id,dir)
+        # s is a offset, length
+        block["dirs"].append((dir, tuple(int(i) for i in s.split(','))))
+    for i in range(block["height"]):
+        block["walls"].append(parser.get(id, 'line' + str(i)))
+    items = parser.items(id)
+    for name, val in items:
+        if len(name) == 1 and parser.has_option(id, name+'_chance'):
+            # it's an actual entity spawner definition
+            atts = [(att[len(name)+1:], v) for att, v in items if att.startswith(name+'_') and att != name+'_chance']
+            block["spawners"][name] = (val, parser.getfloat(id, name+'_chance'), atts)
+    return block
+
+def _compile_layout(path):
+    """Returns a dict of a layout file's options."""
+    parser = ConfigParser.RawConfigParser()
+    parser.read(path)
+    return dict(parser.items('layout'))
+
+def _get_catalog(name):
+    """Returns the layout's options and a list of (id, block) for every block in the library, as (layout, blocks).
+
+    Compiled files are kept in a catalog, saved with cPickle to _CATALOG_FILE and kept in memory, along with each
+    file's modification time; Only files added or changed since are parsed again.
+    """
+    global _catalog
+    if _catalog is None:
+        try:
+            with open(_CATALOG_FILE, 'rb') as f:
+                _catalog = cPickle.load(f)
+        except Exception:
+            _catalog = { }
+    paths = ['data/map/'+name+'.layout']
+    paths += ['data/map/blocks/'+id for id in os.listdir('data/map/blocks/') if '.block' in id]
+    catalog = { }
+    changed = False
+    for path in paths:
+        mtime = os.path.getmtime(path)
+        if path in _catalog and _catalog[path][0] == mtime:
+            catalog[path] = _catalog[path]
+        elif path.endswith('.layout'):
+            catalog[path] = (mtime, _compile_layout(path))
+            changed = True
+        else:
+            catalog[path] = (mtime, _compile_block(path, os.path.basename(path).replace('.block','')))
+            changed = True
+    for path in _catalog:
+        if path not in catalog:
+            if path.endswith('.layout'):
+                # layouts not asked for this time stay cached
+                catalog[path] = _catalog[path]
+            else:
+                changed = True
+    _catalog = catalog
+    if changed:
+        try:
+            with open(_CATALOG_FILE, 'wb') as f:
+                cPickle.dump(_catalog, f, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            pass
+    blocks = [(os.path.basename(path).replace('.block',''), catalog[path][1]) for path in paths[1:]]
+    return catalog[paths[0]][1], blocks
+
 class Generator(object):
     
-    def __init__(self,w,h):
-        """Only initialises the map, doesn't generate immediately, until gen_map is called."""
+    def __init__(self,w,h,rng=None,map_class=None):
+        """Only initialises the map, doesn't generate immediately, until gen_map is called.
+
+        Random numbers come from rng, a L{lib.rng.Stream} or anything with the same methods; Defaults to the random
+        module. The map is made with map_class, L{Map} by default.
+        """
         self.width = w
         self.height = h
-        self.map = Map(w,h)
+        self.rng = rng or random
+        self.map = (map_class or Map)(w,h)
     
     def gen_map(self):
         """Returns generated map."""
@@ -52,15 +194,15 @@ class BasicGenerator(Generator):
             # iterate until we reach the right side of the screen
             self.map.add_rect(x, y, 1, height, _FLOOR)
             # every so often increase or decrease the width
-            if random.randint(0,100)<roughness:
-                height += random.randint(-2,2)
+            if self.rng.randint(0,100)<roughness:
+                height += self.rng.randint(-2,2)
                 if height < 3:
                     height = 3
                 if y+height >= self.height:
                     height = self.height-y-1
             # every so often move the point we're at up or down
-            if random.randint(0,100)<wind:
-                y += random.randint(-2,2)
+            if self.rng.randint(0,100)<wind:
+                y += self.rng.randint(-2,2)
                 if y < 1:
                     y = 1
                 if y+height >= self.height:
@@ -70,137 +212,186 @@ class BasicGenerator(Generator):
 
 class BlockGenerator(Generator):
 
-    def __init__(self,w,h):
-        super(BlockGenerator,self).__init__(w,h)
+    # placed blocks are marked in square cells of 2**occupied_bits tiles a side, made on first use like a ChunkedMap's
+    occupied_bits = 6
+
+    def __init__(self,w,h,rng=None,map_class=None):
+        super(BlockGenerator,self).__init__(w,h,rng,map_class)
         self.block_walls = { }
         self.block_dirs = { }
         self.block_widths = { }
         self.block_heights = { }
         self.block_bias = { }
-        self.parser = None
+        self.block_spawners = { }
+        self.exit_index = { }
+        self.layout = None
         self.accepted_sizes = set()
-        self.rects = [ ]
+        self.clear_rects()
         self.entities = [ ]
         self.finish_block = None
         self.finished = False
+        self.start_pos = None
+        self.finish_pos = None
+        self.block_stamps = { }
+
+    def clear_rects(self):
+        """Forgets every placed block."""
+        self.rects = [ ]
+        # (column, row) of a cell to its tiles in row order, 1 for each covered by a placed block; Missing cells are empty
+        self.occupied = { }
+
+    def _get_cells(self,x,y,w,h):
+        """Yields (cell key, start, end, first row, last row + 1) for each occupancy cell a rect on the map overlaps.
+
+        start and end bound the rect's columns within the cell, and the rows are the cell's own.
+        """
+        bits = self.occupied_bits
+        x0, x1 = max(x, 0), min(x + w, self.width)
+        y0, y1 = max(y, 0), min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        for cy in range(y0 >> bits, ((y1 - 1) >> bits) + 1):
+            top = cy << bits
+            for cx in range(x0 >> bits, ((x1 - 1) >> bits) + 1):
+                left = cx << bits
+                yield ((cx, cy), max(x0, left) - left, min(x1, left + (1 << bits)) - left,
+                       max(y0, top) - top, min(y1, top + (1 << bits)) - top)
 
     def add_rect(self,x,y,w,h):
         self.rects.append((x,y,w,h))
+        bits = self.occupied_bits
+        for key, start, end, first, last in self._get_cells(x, y, w, h):
+            cell = self.occupied.get(key)
+            if cell is None:
+                cell = self.occupied[key] = bytearray(1 << (bits * 2))
+            for j in range(first, last):
+                i = j << bits
+                cell[i+start:i+end] = '\x01' * (end - start)
 
     def add_ent(self,x,ox,y,oy,block_id,char):
-        if self.parser.has_option(block_id,char) and self.parser.has_option(block_id,char+"_chance"):
+        spawners = self.block_spawners[block_id]
+        if char.lower() in spawners:
             #it's an actual entity spawner definition
-            lookup_name = self.parser.get(block_id,char)
-            ret = [x+ox, y+oy, char+str(x)+str(y), lookup_name, self.parser.getfloat(block_id,char+'_chance')]
-            ret2 = []
-            for items in self.parser.items(block_id):
-                name, val = items
-                if name.startswith(char+'_') and name != char+"_chance":
-                    att = name.replace(char+'_','')
-                    ret2.append((att,val))
-            ret.append(ret2)
-            self.entities.append(tuple(ret))
+            lookup_name, chance, atts = spawners[char.lower()]
+            self.entities.append((x+ox, y+oy, char+str(x)+str(y), lookup_name, chance, list(atts)))
+
+    def get_stamp(self,id):
+        """Returns a block's floor pattern, its mask, and the (column, row, char) of each spawner in it."""
+        if id not in self.block_stamps:
+            floor = chr(self.map.palette.get_id_for(_FLOOR))
+            pattern = [floor * len(line) for line in self.block_walls[id]]
+            mask = [line.translate(_BLOCK_MASK) for line in self.block_walls[id]]
+            spawns = [ ]
+            for i in range(len(self.block_walls[id])):
+                for j in range(len(self.block_walls[id][i])):
+                    char = self.block_walls[id][i][j]
+                    if char != '#' and char.lower() in self.block_spawners[id]:
+                        spawns.append((j,i,char))
+            self.block_stamps[id] = (pattern, mask, spawns)
+        return self.block_stamps[id]
+
+    def get_floor(self,x,y,id):
+        """Returns the position of the first floor tile of a block placed at (x,y)."""
+        pattern, mask, spawns = self.get_stamp(id)
+        for i in range(len(mask)):
+            j = mask[i].find('\x01')
+            if j != -1:
+                return x+j, y+i
+        return x, y
 
     def place_block(self,x,y,id):
-        for i in range(len(self.block_walls[id])):
-            for j in range(len(self.block_walls[id][i])):
-                char = self.block_walls[id][i][j]
-                if char != '#':
-                    self.map.add_tile(x+j,y+i,_FLOOR)
-                    self.add_ent(x,j,y,i,id,char)
+        pattern, mask, spawns = self.get_stamp(id)
+        self.map.stamp(x,y,pattern,mask)
+        for j, i, char in spawns:
+            self.add_ent(x,j,y,i,id,char)
 
 
     def check_rect(self,x,y,w,h):
-        if x<0 or y<0 or x+w>self.width or y+h>self.height:
-            return True
-        if (x,y,w,h) in self.rects:
-            return True
-        return False
+        """Returns True if the rect isn't all inside the map."""
+        return x<0 or y<0 or x+w>self.width or y+h>self.height
 
     def check_col(self,rect):
+        """Returns True if the rect goes off the map or overlaps a placed block; Takes time in its height."""
         if self.check_rect(*rect):
             return True
-        for rect2 in self.rects:
-            if (rect[0] < rect2[0]+rect2[2] and rect[0]+rect[2] > rect2[0]
-                  and rect[1] < rect2[1]+rect2[3] and rect[1]+rect2[3] > rect2[1]):
-                return True
+        bits = self.occupied_bits
+        for key, start, end, first, last in self._get_cells(*rect):
+            cell = self.occupied.get(key)
+            if cell is None:
+                continue
+            for j in range(first, last):
+                i = j << bits
+                if cell.find('\x01', i+start, i+end) != -1:
+                    return True
         return False
 
     def set_layout(self,name):
+        """Loads a layout and the block library, from the compiled catalog where it's up to date."""
         if os.path.exists('data/map/'+name+'.layout'):
-            self.parser = ConfigParser.RawConfigParser()
+            self.layout, blocks = _get_catalog(name)
             self.block_walls = { }
             self.block_dirs = { }
             self.block_widths = { }
             self.block_heights = { }
             self.block_bias = { }
-            self.rects = [ ]
+            self.block_spawners = { }
+            self.block_stamps = { }
+            self.clear_rects()
             self.entities = [ ]
-            # read in the layout
-            self.parser.read('data/map/'+name+'.layout')
             self.accepted_sizes = set()
-            for id in os.listdir('data/map/blocks/'):
-                if '.block' in id:
-                    id = id.replace('.block','')
-                    # read in the blocks and add their data to the dicts
-                    self.parser.read('data/map/blocks/'+id+'.block')
-                    self.block_widths[id] = self.parser.getint(id,'width')
-                    self.block_heights[id] = self.parser.getint(id,'height')
-                    self.block_dirs[id] = { }
-                    if self.parser.has_option('layout', id):
-                        self.block_bias[id] = self.parser.getfloat('layout', id)
-                    elif self.parser.has_option('layout', id[-2]):
-                        self.block_bias[id] = self.parser.getfloat('layout', id)
-                    else:
-                        self.block_bias[id] = 0.5
-                    for dir in ('top', 'bottom', 'left', 'right'):
-                        s = self.parser.get(id,dir)
-                        # s is a offset, length
-                        self.block_dirs[id][dir] = tuple(map(int,s.split(',')))
-                    self.block_walls[id] = [ ]
-                    for i in range(self.block_heights[id]):
-                        line = self.parser.get(id, 'line' + str(i))
-                        self.block_walls[id].append(line)
-                    self.accepted_sizes.add((self.block_widths[id],self.block_heights[id]))
+            for id, block in blocks:
+                self.block_widths[id] = block["width"]
+                self.block_heights[id] = block["height"]
+                self.block_dirs[id] = dict(block["dirs"])
+                self.block_walls[id] = block["walls"]
+                self.block_spawners[id] = block["spawners"]
+                if id in self.layout:
+                    self.block_bias[id] = float(self.layout[id])
+                elif id[:-2] in self.layout:
+                    # rotations of a block share its bias
+                    self.block_bias[id] = float(self.layout[id[:-2]])
+                else:
+                    self.block_bias[id] = 0.5
+                self.accepted_sizes.add((self.block_widths[id],self.block_heights[id]))
+            self.index_exits()
+
+    def index_exits(self):
+        """Indexes the blocks by their exits, for L{choose_block}.
+
+        exit_index maps (side, exit width) to a list of (block, exit offset, width, height, weight) for every block
+        with an exit of that width on that side.
+        """
+        self.exit_index = { }
+        for block in self.block_dirs.keys():
+            for dir, exit in self.block_dirs[block].iteritems():
+                if exit[1]:
+                    self.exit_index.setdefault((dir, exit[1]), []).append((block, exit[0], self.block_widths[block],
+                            self.block_heights[block], int(self.block_bias[block]*100)))
 
     def choose_block(self, old_x, old_y, old_id, old_dir):
-        new_dir = "bottom"
-        if old_dir == "bottom":
-            new_dir = "top"
-        elif old_dir == "left":
-            new_dir = "right"
-        elif old_dir == "right":
-            new_dir = "left"
-        width = self.block_dirs[old_id][old_dir][1]
+        """Picks a block to place against an exit of a placed block, weighted by bias; Returns (x, y, id) or None.
+
+        Only blocks with an exit of the same width on the facing side are tried.
+        """
+        off, width = self.block_dirs[old_id][old_dir]
+        x = old_x + self.block_widths[old_id] * (old_dir == "right")
+        y = old_y + self.block_heights[old_id] * (old_dir == "bottom")
+        totals = [ ]
         valid_blocks = [ ]
-        for block in self.block_dirs.keys():
-            dir = self.block_dirs[block][new_dir]
-            if dir[1] == width:
-                #the exit fits, let's see if it has room from the other blocks
-                x = old_x
-                y = old_y
-                w = self.block_widths[block]
-                h = self.block_heights[block]
-                x += self.block_widths[old_id] * (old_dir == "right") - w * (old_dir == "left")
-                y += self.block_heights[old_id] * (old_dir == "bottom") - h * (old_dir == "top")
-                off = self.block_dirs[old_id][old_dir][0]
-                n_off = dir[0]
-                #we offset the new block so that the two exits more or less line up
-                if old_dir in ("left", "right"):
-                    y -= (n_off - off) - (width - dir[1])/2
-                elif old_dir in ("top", "bottom"):
-                    x -= (n_off - off) - (width - dir[1])/2
-                if not self.check_col((x,y,w,h)):
-                    valid_blocks.append((x,y,block))
-        if valid_blocks:
-            choices = []
-            for block in valid_blocks:
-                x, y, id = block
-                chance = int(self.block_bias[id]*100)
-                choices += [block for i in range(chance)]
-            if choices:
-                return random.choice(choices)
-            return None
+        total = 0
+        for block, n_off, w, h, chance in self.exit_index.get((_OPPOSITE[old_dir], width), ()):
+            #we offset the new block so that the two exits line up
+            if old_dir in ("left", "right"):
+                rect = (x - w * (old_dir == "left"), y - (n_off - off), w, h)
+            else:
+                rect = (x - (n_off - off), y - h * (old_dir == "top"), w, h)
+            if chance > 0 and not self.check_col(rect):
+                total += chance
+                totals.append(total)
+                valid_blocks.append((rect[0], rect[1], block))
+        if total:
+            # the same pick as choosing from a list holding each block as many times as its weight
+            return valid_blocks[bisect.bisect_right(totals, int(self.rng.random() * total))]
         return None
 
     def _recurse_gen(self, x, y, block_id):
@@ -216,6 +407,7 @@ class BlockGenerator(Generator):
                     #recurse over it too
                     if choice[2].startswith(self.finish_block):
                         self.finished = True
+                        self.finish_pos = self.get_floor(*choice)
                     self._recurse_gen(*choice)
 
     def gen_map(self):
@@ -223,12 +415,16 @@ class BlockGenerator(Generator):
         while not self.finished or len(self.rects) < 20:
             self.map.clear()
             self.entities = [ ]
-            self.rects = [ ]
-            x, y = random.randint(20, self.width-20), random.randint(20, self.height-20)
-            block = self.parser.get('layout','start')
-            self.finish_block = self.parser.get('layout','end')
+            self.clear_rects()
+            x, y = self.rng.randint(20, self.width-20), self.rng.randint(20, self.height-20)
+            block = self.layout['start']
+            self.finish_block = self.layout['end']
             self.finished = False
+            self.start_pos = self.get_floor(x, y, block)
             self._recurse_gen(x, y, block)
+            if self.finished and not self.map.is_reachable(self.start_pos, self.finish_pos):
+                # the end block was placed, but its exits don't line up with the rest of the level
+                self.finished = False
             it += 1
             if it > 1000:
                 raise Exception
@@ -236,66 +432,782 @@ class BlockGenerator(Generator):
 
 
 class Map:
-    """Contains 2D array of (blocks, blocks_light), and functions to ease modification."""
-    
+    """Contains a flat plane of material IDs, and functions to ease modification.
+
+    The plane is a bytearray of (width+2)*(height+2) cells in row order, with a border of wall all around the map, so
+    that row slices and neighbour reads just off its edges need no special case. Tile (x,y) is at index
+    (y+1)*stride + x+1. Tile flags and drawing come from the materials in L{palette}.
+
+    The single-tile getters still take any coordinates, so they check them against the border with one chained
+    comparison; Clamping them into the border with min and max instead costs twice as much per call in CPython. Code
+    reading many tiles should take rows from L{get_rect} views or L{get_plane}, where the border does the work.
+
+    Every write bumps the version of the regions it touches, square areas of 2**region_bits tiles a side, and calls
+    the map's listeners with the area written, so caches of parts of the map can tell when those parts change.
+    """
+
+    palette = material.palette
+
+    region_bits = 5
+
+    # True if the tiles are kept in one flat plane, for L{get_plane} and L{get_planes}; They return None otherwise, and
+    # the tiles have to be read through L{get_rect} views.
+    has_plane = True
+
+    # L{connectivity.Connectivity} and L{grid.Grid} kept up to date with the map, once asked for.
+    connectivity = None
+    grid = None
+
     def __init__(self,w,h):
         """Initialised with light-blocking walls."""
         self.width = w
         self.height = h
+        self.stride = w + 2
+        self.init_versions()
         self.clear()
 
-    def add_tile(self, x, y, tile):
-        """Replaces tile with given tuple."""
+    def init_versions(self):
+        """Sets up version counters and listeners; Called before the map's first write."""
+        # version is bumped by every write; Regions keep the version of the last write to them, except that a write
+        # to the whole map just sets base_version, so regions not in versions are at base_version.
+        self.version = 0
+        self.base_version = 0
+        self.versions = { }
+        self.listeners = [ ]
+
+    def _changed(self, x, y, w, h):
+        """Called after the tiles of the (w,h) area starting at (x,y) are written."""
+        self.version += 1
+        if x <= 0 and y <= 0 and x + w >= self.width and y + h >= self.height:
+            self.base_version = self.version
+            self.versions = { }
+        else:
+            bits = self.region_bits
+            for ry in range(y >> bits, ((y + h - 1) >> bits) + 1):
+                for rx in range(x >> bits, ((x + w - 1) >> bits) + 1):
+                    self.versions[rx, ry] = self.version
+        for listener in self.listeners:
+            listener(x, y, w, h)
+
+    def _changed_all(self):
+        self._changed(0, 0, self.width, self.height)
+
+    def add_listener(self, listener):
+        """Adds a function of (x, y, w, h) called with the area written after every write to the map."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Removes a listener added with L{add_listener}."""
+        self.listeners.remove(listener)
+
+    def get_region(self, x, y):
+        """Returns the key of the version region holding (x,y)."""
+        return x >> self.region_bits, y >> self.region_bits
+
+    def get_version(self, x, y):
+        """Returns the version of the region holding (x,y), which changes whenever a tile in the region is written."""
+        return self.versions.get((x >> self.region_bits, y >> self.region_bits), self.base_version)
+
+    def get_region_version(self, region):
+        """Returns the version of a region, by its key from L{get_region}."""
+        return self.versions.get(region, self.base_version)
+
+    def get_connectivity(self):
+        """Returns the map's L{connectivity.Connectivity}, which labels connected walkable areas."""
+        if self.connectivity is None:
+            self.connectivity = connectivity.Connectivity(self)
+            self.add_listener(self.connectivity.update)
+        return self.connectivity
+
+    def get_grid(self):
+        """Returns the map's L{grid.Grid}, which merges tile flags with blocking and opaque entities."""
+        if self.grid is None:
+            self.grid = grid.Grid(self)
+            self.add_listener(self.grid.update)
+        return self.grid
+
+    def is_reachable(self, a, b):
+        """Returns True if positions a and b are connected by walkable tiles."""
+        return self.get_connectivity().is_reachable(a, b)
+
+    def get_index(self, x, y):
+        """Returns the index of a tile in the plane."""
+        return (y+1)*self.stride + x+1
+
+    def set_material(self, x, y, id):
+        """Replaces tile with the material of the given ID."""
         if 0 < x < self.width and 0 < y < self.height:
-            self.tiles[x+1][y+1] = tile
-    
+            self.tiles[(y+1)*self.stride + x+1] = id
+            self._changed(x, y, 1, 1)
+
+    def get_material(self, x, y):
+        """Returns the material ID of a tile; Wall if tile not in map."""
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            return self.tiles[(y+1)*self.stride + x+1]
+        return material.WALL
+
+    def add_tile(self, x, y, tile):
+        """Replaces tile with the first material registered with the given tuple's flags."""
+        self.set_material(x, y, self.palette.get_id_for(tile))
+
     def add_rect(self, x, y, w, h, tile):
         """Draws a rectangle of starting at (x,y), (w,h) size."""
-        for i in range(w):
-            for j in range(h):
-                self.add_tile(x+i, y+j, tile)
+        self.fill_rect(x, y, w, h, self.palette.get_id_for(tile))
+
+    def _write_row(self, x, y, row, mask=None):
+        """Writes a bytearray of material IDs from (x,y) rightwards, where mask is nonzero if given.
+
+        Anything outside the tiles L{set_material} can write is left out.
+        """
+        if not 0 < y < self.height:
+            return
+        start = max(x, 1)
+        end = min(x + len(row), self.width)
+        base = (y+1)*self.stride + 1
+        if start >= end:
+            return
+        if mask is None:
+            self.tiles[base+start:base+end] = row[start-x:end-x]
+        else:
+            for a, b in _get_runs(mask):
+                a = max(a + x, start)
+                b = min(b + x, end)
+                if a < b:
+                    self.tiles[base+a:base+b] = row[a-x:b-x]
+        self._changed(start, y, end-start, 1)
+
+    def fill_rect(self, x, y, w, h, id):
+        """Fills a rectangle starting at (x,y), (w,h) size, with the material of the given ID."""
+        row = bytearray(chr(id) * max(w, 0))
+        for j in range(h):
+            self._write_row(x, y+j, row)
+
+    def stamp(self, x, y, pattern, mask=None):
+        """Writes a 2D pattern of material IDs with its top left corner at (x,y).
+
+        pattern is a list of rows, each a str or bytearray of IDs. mask, if given, is a list of rows of the same
+        size, and only tiles where it's nonzero are written.
+        """
+        for j in range(len(pattern)):
+            if mask is None:
+                self._write_row(x, y+j, bytearray(pattern[j]))
+            else:
+                self._write_row(x, y+j, bytearray(pattern[j]), mask[j])
+
+    def copy_region(self, src, sx, sy, w, h, x, y):
+        """Copies the (w,h) region of map src starting at (sx,sy) to (x,y) on this map.
+
+        Tiles past the source's border are copied as wall.
+        """
+        view = src.get_rect(sx, sy, w, h, view=True)
+        rows = [ ]
+        for j in range(h):
+            row = bytearray(chr(material.WALL) * w)
+            start, ids = view.get_row(j)
+            row[start:start+len(ids)] = ids
+            rows.append(row)
+        # read everything before writing, in case src is this map
+        self.stamp(x, y, rows)
+
+    def flood_fill(self, x, y, id):
+        """Replaces the 4-connected area of tiles with the same material as (x,y) by the given material.
+
+        Returns the number of tiles changed. Works a whole row span at a time, and reports the bounding box of the
+        spans written as the area changed.
+        """
+        if not (0 < x < self.width and 0 < y < self.height):
+            return 0
+        stride = self.stride
+        old = self.tiles[(y+1)*stride + x+1]
+        if old == id:
+            return 0
+        # 1 where the fill may go: tiles of the old material that can be written
+        table = bytearray(256)
+        table[old] = 1
+        match = bytearray(self.tiles).translate(table)
+        match[:2*stride] = bytearray(2*stride)
+        match[(self.height+1)*stride:] = bytearray(len(match) - (self.height+1)*stride)
+        for j in range(2, self.height+1):
+            match[j*stride] = match[j*stride+1] = match[j*stride+stride-1] = 0
+        count = 0
+        min_x, min_y, max_x, max_y = x, y, x, y
+        stack = [(y+1)*stride + x+1]
+        while stack:
+            k = stack.pop()
+            if not match[k]:
+                continue
+            row_start = k - k % stride
+            left = match.rfind('\x00', row_start, k) + 1
+            right = match.find('\x00', k, row_start + stride)
+            self.tiles[left:right] = bytearray(chr(id) * (right-left))
+            match[left:right] = bytearray(right-left)
+            count += right - left
+            j = k // stride - 1
+            min_x = min(min_x, left - row_start - 1)
+            max_x = max(max_x, right - row_start - 2)
+            min_y = min(min_y, j)
+            max_y = max(max_y, j)
+            for near in (left - stride, left + stride):
+                for a, b in _get_runs(match[near:near + right-left]):
+                    stack.append(near + a)
+        self._changed(min_x, min_y, max_x - min_x + 1, max_y - min_y + 1)
+        return count
 
     def get_tile(self,x,y):
         """Returns wall if tile not in map."""
-        if 0 < x < self.width and 0 < y < self.height:
-            return self.tiles[x+1][y+1]
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            id = self.tiles[(y+1)*self.stride + x+1]
+            return self.palette.blocks[id], self.palette.blocks_light[id]
         return _WALL
 
-    def get_tiles(self):
-        """Returns the whole map."""
-        return self.get_rect(0,0,self.width,self.height)
+    def get_tiles(self, view=False):
+        """Returns the whole map; A L{MapView} of it if view is True."""
+        return self.get_rect(0,0,self.width,self.height,view)
 
-    def get_rect(self, x, y, w, h):
-        """Returns a 2D array section of the original map, starting at (x,y) with size (w,h)."""
-        ret = [[_WALL for i in range(h)] for j in range(w)]
-        for i in range(w):
-            for j in range(h):
-                ret[i][j] = self.get_tile(x+i, y+j)
-        return ret
+    def get_rect(self, x, y, w, h, view=False):
+        """Returns a 2D array section of the original map, starting at (x,y) with size (w,h).
+
+        If view is True, returns a L{MapView} reading straight from the map's plane instead of a copy.
+        """
+        if view:
+            return MapView(self, x, y, w, h)
+        return MapView(self, x, y, w, h).copy()
 
     def get_blocking_light(self,x,y):
         """Returns True if the tile is blocking to light."""
-        return self.get_tile(x,y)[1]
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            return self.palette.blocks_light[self.tiles[(y+1)*self.stride + x+1]]
+        return _WALL[1]
 
     def get_blocking(self,x,y):
         """Returns True if the tile is blocking."""
-        return self.get_tile(x,y)[0]
+        if -1 <= x <= self.width and -1 <= y <= self.height:
+            return self.palette.blocks[self.tiles[(y+1)*self.stride + x+1]]
+        return _WALL[0]
+
+    def get_plane(self):
+        """Returns the whole plane of material IDs, border included; Index it with L{get_index}.
+
+        The plane is the map's own storage, not a copy. None if the map has no flat plane, see L{has_plane}.
+        """
+        return self.tiles
+
+    def get_span(self, start, end):
+        """Returns a memoryview of the plane of material IDs from index start to end."""
+        return memoryview(self.tiles)[start:end]
+
+    def get_planes(self):
+        """Returns blocks and blocks_light planes, laid out like the plane of material IDs.
+
+        They're made from the IDs in one pass each, and aren't updated along with the map. None if the map has no flat
+        plane, see L{has_plane}.
+        """
+        if not self.has_plane:
+            return None
+        tiles = bytearray(self.get_plane())
+        return tiles.translate(self.palette.blocks), tiles.translate(self.palette.blocks_light)
 
     def save(self):
         """Returns list of lines representing map in save format (JSON).
 
-        Only stores non (1,1) tiles, to reduce bloat.
+        Stores the plane of material IDs compressed, along with the material names, to match them up on load.
         """
         lines = ["{"]
         lines += ['"size" : [{0},{1}],'.format(self.width,self.height)]
-        for i in range(self.width):
-            for j in range(self.height):
-                if self.get_tile(i,j) != _WALL:
-                    lines += ['"{0},{1}" : [{2},{3}],'.format(i, j, *self.get_tile(i,j))]
-        lines[-1] = lines[-1][:-1]
+        lines += ['"materials" : {0},'.format(json.dumps(self.palette.get_names()))]
+        lines += ['"tiles" : "{0}"'.format(base64.b64encode(zlib.compress(str(bytearray(self.tiles)))))]
         lines += ["},"]
         return lines
 
+    def load(self, data):
+        """Loads tiles from save format data, as produced by any map type's save, and parsed from JSON."""
+        if "tiles" in data and tuple(data["size"]) == (self.width, self.height):
+            plane = bytearray(zlib.decompress(base64.b64decode(data["tiles"])))
+            remap = self.palette.get_remap(data["materials"])
+            if remap is not None:
+                plane = plane.translate(remap)
+            self.tiles[:] = plane
+            self._changed_all()
+            return
+        for x, y, id in _get_saved_tiles(data, self.palette):
+            self.set_material(x, y, id)
+
+    def clear(self):
+        """Defaults everything to light-blocking walls.
+
+        The plane is refilled in place, so views and planes handed out earlier stay attached to the map.
+        """
+        size = self.stride * (self.height+2)
+        if getattr(self, 'tiles', None) is not None and len(self.tiles) == size:
+            self.tiles[:] = chr(material.WALL) * size
+        else:
+            self.tiles = bytearray(chr(material.WALL) * size)
+        self._changed_all()
+
+
+class ChunkedMap(Map):
+    """A sparse map, for very large levels that are mostly wall.
+
+    Tiles are kept in square chunks of 2**chunk_bits tiles a side, each with its own plane of material IDs. Chunks are
+    only allocated when a tile in them is first written, and missing chunks read as wall, so memory follows the carved
+    area rather than the map's size. Has the same tile API as L{Map}, but no flat plane: has_plane is False, and
+    L{get_chunk} gives the plane of a single chunk instead.
+    """
+
+    chunk_bits = 5
+
+    has_plane = False
+    tiles = None
+
+    def __init__(self,w,h):
+        """Initialised with light-blocking walls; Version regions are the chunks."""
+        self.region_bits = self.chunk_bits
+        self.chunk_size = 1 << self.chunk_bits
+        self.chunk_mask = self.chunk_size - 1
+        Map.__init__(self,w,h)
+
+    def get_chunk(self, x, y, create=False):
+        """Returns the plane of the chunk holding (x,y); None if it isn't allocated, unless create is set."""
+        key = (x >> self.chunk_bits, y >> self.chunk_bits)
+        chunk = self.chunks.get(key)
+        if chunk is None and create:
+            chunk = self.chunks[key] = bytearray(chr(material.WALL) * (self.chunk_size * self.chunk_size))
+        return chunk
+
+    def get_chunk_count(self):
+        """Returns the number of allocated chunks."""
+        return len(self.chunks)
+
+    def set_chunk(self, cx, cy, chunk):
+        """Puts a plane in place as chunk (cx,cy), or drops the chunk if chunk is None; Returns the plane replaced."""
+        old = self.chunks.pop((cx, cy), None)
+        if chunk is not None:
+            self.chunks[cx, cy] = chunk
+        self._changed(cx << self.chunk_bits, cy << self.chunk_bits, self.chunk_size, self.chunk_size)
+        return old
+
+    def get_grid(self):
+        """Returns the map's L{grid.ChunkedGrid}, which merges tile flags with blocking and opaque entities."""
+        if self.grid is None:
+            self.grid = grid.ChunkedGrid(self)
+            self.add_listener(self.grid.update)
+        return self.grid
+
+    def get_index(self, x, y):
+        """Returns the index of a tile within its chunk's plane."""
+        return ((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)
+
+    def set_material(self, x, y, id):
+        """Replaces tile with the material of the given ID."""
+        if 0 < x < self.width and 0 < y < self.height:
+            chunk = self.get_chunk(x, y, True)
+            chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)] = id
+            self._changed(x, y, 1, 1)
+
+    def get_material(self, x, y):
+        """Returns the material ID of a tile; Wall if tile not in map."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return material.WALL
+        return chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
+
+    def _write_row(self, x, y, row, mask=None):
+        """Writes a bytearray of material IDs from (x,y) rightwards, where mask is nonzero if given.
+
+        Splits the row at chunk edges, and only allocates chunks that get written to.
+        """
+        if not 0 < y < self.height:
+            return
+        start = max(x, 1)
+        end = min(x + len(row), self.width)
+        if mask is None:
+            spans = [(start, end)]
+        else:
+            spans = [(max(a + x, start), min(b + x, end)) for a, b in _get_runs(mask)]
+        base = (y & self.chunk_mask) << self.chunk_bits
+        for a, b in spans:
+            while a < b:
+                c = min(b, (a | self.chunk_mask) + 1)
+                chunk = self.get_chunk(a, y, True)
+                chunk[base + (a & self.chunk_mask):base + ((c-1) & self.chunk_mask) + 1] = row[a-x:c-x]
+                a = c
+        if start < end:
+            self._changed(start, y, end-start, 1)
+
+    def flood_fill(self, x, y, id):
+        """Replaces the 4-connected area of tiles with the same material as (x,y) by the given material.
+
+        Returns the number of tiles changed. Finds row spans tile by tile, but fills each with L{fill_rect}.
+        """
+        if not (0 < x < self.width and 0 < y < self.height):
+            return 0
+        get_material = self.get_material
+        old = get_material(x, y)
+        if old == id:
+            return 0
+        count = 0
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            if get_material(x, y) != old:
+                continue
+            left = x
+            while left > 1 and get_material(left-1, y) == old:
+                left -= 1
+            right = x + 1
+            while right < self.width and get_material(right, y) == old:
+                right += 1
+            self.fill_rect(left, y, right-left, 1, id)
+            count += right - left
+            for near in (y-1, y+1):
+                if 0 < near < self.height:
+                    inside = False
+                    for i in range(left, right):
+                        if get_material(i, near) == old:
+                            if not inside:
+                                stack.append((i, near))
+                            inside = True
+                        else:
+                            inside = False
+        return count
+
+    def get_tile(self, x, y):
+        """Returns wall if tile not in map."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return _WALL
+        id = chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]
+        return self.palette.blocks[id], self.palette.blocks_light[id]
+
+    def get_blocking_light(self, x, y):
+        """Returns True if the tile is blocking to light."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return _WALL[1]
+        return self.palette.blocks_light[chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]]
+
+    def get_blocking(self, x, y):
+        """Returns True if the tile is blocking."""
+        chunk = self.chunks.get((x >> self.chunk_bits, y >> self.chunk_bits))
+        if chunk is None:
+            return _WALL[0]
+        return self.palette.blocks[chunk[((y & self.chunk_mask) << self.chunk_bits) + (x & self.chunk_mask)]]
+
+    def get_rect(self, x, y, w, h, view=False):
+        """Returns a 2D array section of the original map, starting at (x,y) with size (w,h).
+
+        If view is True, returns a L{ChunkedMapView} reading straight from the map's chunks instead of a copy.
+        """
+        if view:
+            return ChunkedMapView(self, x, y, w, h)
+        return ChunkedMapView(self, x, y, w, h).copy()
+
+    def save(self):
+        """Returns list of lines representing map in save format (JSON).
+
+        Stores each allocated chunk's plane of material IDs compressed, along with the material names.
+        """
+        chunks = { }
+        for cx, cy in self.chunks:
+            chunks['{0},{1}'.format(cx, cy)] = base64.b64encode(zlib.compress(str(self.chunks[cx, cy])))
+        lines = ["{"]
+        lines += ['"size" : [{0},{1}],'.format(self.width,self.height)]
+        lines += ['"materials" : {0},'.format(json.dumps(self.palette.get_names()))]
+        lines += ['"chunk_bits" : {0},'.format(self.chunk_bits)]
+        lines += ['"chunks" : {0}'.format(json.dumps(chunks, sort_keys=True))]
+        lines += ["},"]
+        return lines
+
+    def load(self, data):
+        """Loads tiles from save format data, as produced by any map type's save, and parsed from JSON."""
+        if "chunks" in data and data["chunk_bits"] == self.chunk_bits:
+            remap = self.palette.get_remap(data["materials"])
+            for key in data["chunks"]:
+                cx, cy = key.split(",",1)
+                chunk = bytearray(zlib.decompress(base64.b64decode(data["chunks"][key])))
+                if remap is not None:
+                    chunk = chunk.translate(remap)
+                self.chunks[int(cx), int(cy)] = chunk
+            self._changed_all()
+            return
+        for x, y, id in _get_saved_tiles(data, self.palette):
+            self.set_material(x, y, id)
+
+    def clear(self):
+        """Defaults everything to light-blocking walls, dropping every chunk."""
+        self.chunks = { }
+        self._changed_all()
+
+
+class MappedMap(Map):
+    """A map whose plane lives in a memory-mapped file, for large persistent levels.
+
+    The file holds a small header with the map's size, followed by the plane of material IDs laid out as in L{Map}.
+    Opening an existing file maps it without reading it, and the OS pages tiles in as they're used. Saving only
+    flushes the changed pages, and the save format records the file's path and material names instead of the tiles.
+
+    Without a path the map is held in anonymous memory until L{set_file} is called, and saves as a plain L{Map}.
+    """
+
+    header = struct.Struct('<4sII')
+    magic = 'PYMM'
+
+    def __init__(self,w,h,path=None,create=True):
+        """Opens the map file at path, creating it with light-blocking walls if it doesn't exist and create is set.
+
+        Raises ValueError if an existing file isn't a map file of size (w,h), and IOError if there's no file and
+        create isn't set.
+        """
+        self.width = w
+        self.height = h
+        self.stride = w + 2
+        self.path = None
+        self.file = None
+        self.mmap = None
+        self.init_versions()
+        self.open(path, create)
+
+    def open(self, path, create=True):
+        """Maps the plane from the file at path, or from anonymous memory if path is None.
+
+        A missing file is created if create is set; Otherwise IOError is raised.
+        """
+        if path is not None and not create and not os.path.exists(path):
+            raise IOError("no map file at {0}".format(path))
+        self.close()
+        size = self.stride * (self.height+2)
+        length = self.header.size + size
+        fresh = True
+        if path is None:
+            self.mmap = mmap.mmap(-1, length)
+        else:
+            if os.path.exists(path):
+                self.file = open(path, 'r+b')
+                head = self.file.read(self.header.size)
+                if (len(head) < self.header.size or self.header.unpack(head) != (self.magic, self.width, self.height)
+                        or os.path.getsize(path) != length):
+                    self.file.close()
+                    self.file = None
+                    raise ValueError("{0} isn't a {1}x{2} map file".format(path, self.width, self.height))
+                fresh = False
+            else:
+                self.file = open(path, 'w+b')
+                self.file.truncate(length)
+            self.mmap = mmap.mmap(self.file.fileno(), length)
+        self.path = path
+        self.tiles = (ctypes.c_ubyte * size).from_buffer(self.mmap, self.header.size)
+        if fresh:
+            self.mmap[:self.header.size] = self.header.pack(self.magic, self.width, self.height)
+            self.clear()
+        else:
+            self._changed_all()
+
+    def get_plane(self):
+        """Returns the whole plane of material IDs, border included, as a ctypes array over the file's memory.
+
+        Raises ValueError if the map is closed. The array is only good until L{close} or L{set_file}, so look it up
+        again rather than keeping it.
+        """
+        if self.mmap is None:
+            raise ValueError("map file is closed")
+        return self.tiles
+
+    def get_span(self, start, end):
+        """Returns a memoryview of a copy of the plane from index start to end.
+
+        The file's memory itself isn't handed out, since it's unmapped by L{close}.
+        """
+        if self.mmap is None:
+            raise ValueError("map file is closed")
+        return memoryview(bytearray(self.mmap[self.header.size + start:self.header.size + end]))
+
+    def set_file(self, path):
+        """Moves the map to a new file at path, which is overwritten, and keeps using it from then on."""
+        tiles = bytearray(self.tiles)
+        self.close()
+        if os.path.exists(path):
+            os.remove(path)
+        self.open(path)
+        self.tiles[:] = tiles
+        self._changed_all()
+
+    def flush(self):
+        """Writes changed pages back to the file."""
+        if self.file is not None:
+            self.mmap.flush()
+
+    def close(self):
+        """Flushes and unmaps the file; The map can't be used until L{open} is called again."""
+        if self.mmap is not None:
+            self.flush()
+            self.tiles = None
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def save(self):
+        """Returns list of lines representing map in save format (JSON).
+
+        Flushes the file and only stores its path; Stores the tiles like L{Map.save} if the map has no file.
+        """
+        if self.path is None:
+            return Map.save(self)
+        self.flush()
+        lines = ["{"]
+        lines += ['"size" : [{0},{1}],'.format(self.width,self.height)]
+        lines += ['"materials" : {0},'.format(json.dumps(self.palette.get_names()))]
+        lines += ['"file" : {0}'.format(json.dumps(self.path))]
+        lines += ["},"]
+        return lines
+
+    def load(self, data):
+        """Loads tiles from save format data; For data with the map's own file, only matches up material IDs."""
+        if self.path is None or data.get("file") != self.path:
+            return Map.load(self, data)
+        remap = self.palette.get_remap(data.get("materials", ()))
+        if remap is not None:
+            self.tiles[:] = bytearray(self.tiles).translate(remap)
+            self._changed_all()
+
     def clear(self):
         """Defaults everything to light-blocking walls."""
-        self.tiles = [[_WALL for i in range(self.height+2)] for j in range(self.width+2)]
+        ctypes.memset(self.tiles, material.WALL, self.stride * (self.height+2))
+        self._changed_all()
+
+
+class MapView(object):
+    """A window of a map, starting at (x,y) with size (w,h), reading the map's plane without copying it.
+
+    Tiles are addressed relative to the window; Anything beyond the map's border reads as wall, like L{Map.get_tile}.
+    The view follows later changes to the map, call L{copy} for a snapshot. It looks the plane up from the map on every
+    read, so it also follows a L{MappedMap} to a new file, and fails cleanly once the map is closed.
+    """
+
+    def __init__(self, map, x, y, w, h):
+        self.map = map
+        self.x = x
+        self.y = y
+        self.width = w
+        self.height = h
+        self.stride = map.stride
+        self.palette = map.palette
+        # index of the window's (0,0) in the plane, which may lie outside it if the window hangs off the map
+        self.origin = map.get_index(x, y)
+        # the part of the window that's on the map, border included, in window coordinates
+        self.min_x = max(0, -1-x)
+        self.min_y = max(0, -1-y)
+        self.max_x = min(w, map.width+1-x)
+        self.max_y = min(h, map.height+1-y)
+
+    def get_material(self, i, j):
+        """Returns the material ID of the tile at (i,j) of the window."""
+        if self.min_x <= i < self.max_x and self.min_y <= j < self.max_y:
+            return self.map.get_plane()[self.origin + j*self.stride + i]
+        return material.WALL
+
+    def get_tile(self, i, j):
+        """Returns the tile at (i,j) of the window."""
+        if self.min_x <= i < self.max_x and self.min_y <= j < self.max_y:
+            id = self.map.get_plane()[self.origin + j*self.stride + i]
+            return self.palette.blocks[id], self.palette.blocks_light[id]
+        return _WALL
+
+    def get_blocking(self, i, j):
+        """Returns True if the tile at (i,j) of the window is blocking."""
+        if self.min_x <= i < self.max_x and self.min_y <= j < self.max_y:
+            return self.palette.blocks[self.map.get_plane()[self.origin + j*self.stride + i]]
+        return _WALL[0]
+
+    def get_blocking_light(self, i, j):
+        """Returns True if the tile at (i,j) of the window is blocking to light."""
+        if self.min_x <= i < self.max_x and self.min_y <= j < self.max_y:
+            return self.palette.blocks_light[self.map.get_plane()[self.origin + j*self.stride + i]]
+        return _WALL[1]
+
+    def get_row(self, j):
+        """Returns the first column of row j that's on the map, and a memoryview of the row's material IDs from it.
+
+        The memoryview covers the row up to the map's border or the window's edge, and is empty if row j is off the
+        map. It comes from L{Map.get_span}, so it reads the plane directly except on a L{MappedMap}.
+        """
+        if not (self.min_y <= j < self.max_y) or self.min_x >= self.max_x:
+            return self.min_x, memoryview(bytearray())
+        start = self.origin + j*self.stride + self.min_x
+        return self.min_x, self.map.get_span(start, start + self.max_x - self.min_x)
+
+    def copy(self):
+        """Returns the window as a 2D array of tiles, like L{Map.get_rect}."""
+        ret = [[_WALL for j in range(self.height)] for i in range(self.width)]
+        tiles = self.map.get_plane()
+        blocks = self.palette.blocks
+        blocks_light = self.palette.blocks_light
+        stride = self.stride
+        for i in range(self.min_x, self.max_x):
+            column = ret[i]
+            k = self.origin + i
+            for j in range(self.min_y, self.max_y):
+                id = tiles[k + j*stride]
+                column[j] = blocks[id], blocks_light[id]
+        return ret
+
+
+class ChunkedMapView(MapView):
+    """A L{MapView} of a L{ChunkedMap}, reading tiles from the map's chunks."""
+
+    def __init__(self, map, x, y, w, h):
+        self.map = map
+        self.x = x
+        self.y = y
+        self.width = w
+        self.height = h
+
+    def get_material(self, i, j):
+        """Returns the material ID of the tile at (i,j) of the window."""
+        if 0 <= i < self.width and 0 <= j < self.height:
+            return self.map.get_material(self.x+i, self.y+j)
+        return material.WALL
+
+    def get_tile(self, i, j):
+        """Returns the tile at (i,j) of the window."""
+        if 0 <= i < self.width and 0 <= j < self.height:
+            return self.map.get_tile(self.x+i, self.y+j)
+        return _WALL
+
+    def get_blocking(self, i, j):
+        """Returns True if the tile at (i,j) of the window is blocking."""
+        if 0 <= i < self.width and 0 <= j < self.height:
+            return self.map.get_blocking(self.x+i, self.y+j)
+        return _WALL[0]
+
+    def get_blocking_light(self, i, j):
+        """Returns True if the tile at (i,j) of the window is blocking to light."""
+        if 0 <= i < self.width and 0 <= j < self.height:
+            return self.map.get_blocking_light(self.x+i, self.y+j)
+        return _WALL[1]
+
+    def get_row(self, j):
+        """Returns 0 and a memoryview of row j's material IDs.
+
+        Rows can span several chunks, so unlike L{MapView.get_row} this is a copy.
+        """
+        tiles = bytearray(chr(material.WALL) * self.width)
+        if 0 <= j < self.height:
+            map = self.map
+            y = self.y + j
+            base = (y & map.chunk_mask) << map.chunk_bits
+            x = self.x
+            while x < self.x + self.width:
+                end = min(self.x + self.width, (x | map.chunk_mask) + 1)
+                chunk = map.chunks.get((x >> map.chunk_bits, y >> map.chunk_bits))
+                if chunk is not None:
+                    start = base + (x & map.chunk_mask)
+                    tiles[x-self.x:end-self.x] = chunk[start:start + end-x]
+                x = end
+        return 0, memoryview(tiles)
+
+    def copy(self):
+        """Returns the window as a 2D array of tiles, like L{Map.get_rect}."""
+        get_tile = self.map.get_tile
+        return [[get_tile(self.x+i, self.y+j) for j in range(self.height)] for i in range(self.width)]
@@ -0,0 +1,127 @@
+# Materials give tiles their properties. Maps store a one-byte material ID per tile, and look properties up in the
+# palette's flat tables, indexed by ID.
+#
+# IDs are handed out in registration order; The engine registers 'wall' as WALL (0) and 'floor' as FLOOR (1).
+
+_SIZE = 256
+
+
+class Material(object):
+    """A kind of tile: Its flags, and how the renderer draws it."""
+
+    def __init__(self, id, name, blocks, blocks_light, glyph, dark_glyph, fgcol=None, bgcol=None):
+        """Initialisation method; Use L{Palette.register} rather than creating materials directly.
+
+        @type  id: number
+        @param id: Material ID stored in maps.
+        @type  name: str
+        @param name: Unique name, used to match IDs up in save files.
+        @type  blocks: bool
+        @param blocks: True if the tile can't be walked on.
+        @type  blocks_light: bool
+        @param blocks_light: True if the tile isn't transparent.
+        @type  glyph: str
+        @param glyph: Tile name drawn when the tile is lit.
+        @type  dark_glyph: str
+        @param dark_glyph: Tile name drawn when the tile is explored, but not lit.
+        @type  fgcol: tuple
+        @param fgcol: Colour to draw the tile with, or None for the application's wall or floor colour.
+        @type  bgcol: tuple
+        @param bgcol: Background colour, or None for the window's.
+        """
+        self.id = id
+        self.name = name
+        self.blocks = int(blocks)
+        self.blocks_light = int(blocks_light)
+        self.glyph = glyph
+        self.dark_glyph = dark_glyph
+        self.fgcol = fgcol
+        self.bgcol = bgcol
+
+    def get_tile(self):
+        """Returns the material's (blocks, blocks_light) tile."""
+        return self.blocks, self.blocks_light
+
+
+class Palette(object):
+    """Registry of up to 256 materials.
+
+    blocks and blocks_light are tables of each ID's flags, usable with bytearray.translate to turn a plane of IDs into
+    a plane of flags. IDs not registered read as wall.
+    """
+
+    def __init__(self):
+        self.materials = [ ]
+        self.names = { }
+        self.tiles = { }
+        self.blocks = bytearray('\x01' * _SIZE)
+        self.blocks_light = bytearray('\x01' * _SIZE)
+
+    def __getitem__(self, item):
+        return self.materials[item]
+
+    def __len__(self):
+        return len(self.materials)
+
+    def __contains__(self, item):
+        return item in self.names
+
+    def register(self, name, blocks, blocks_light, glyph, dark_glyph=None, fgcol=None, bgcol=None):
+        """Adds a material and returns its ID; Registering a name again replaces its properties, keeping the ID.
+
+        Raises ValueError if all 256 IDs are in use.
+        """
+        if name in self.names:
+            id = self.names[name]
+        elif len(self.materials) < _SIZE:
+            id = len(self.materials)
+            self.materials.append(None)
+        else:
+            raise ValueError("Palette is full, can't register " + name)
+        mat = Material(id, name, blocks, blocks_light, glyph, dark_glyph or glyph, fgcol, bgcol)
+        self.materials[id] = mat
+        self.names[name] = id
+        self.blocks[id] = mat.blocks
+        self.blocks_light[id] = mat.blocks_light
+        self.tiles.setdefault(mat.get_tile(), id)
+        return id
+
+    def get_id(self, name):
+        """Returns the ID of the named material."""
+        return self.names[name]
+
+    def get_id_for(self, tile):
+        """Returns the ID of the first material registered with the flags of a (blocks, blocks_light) tile.
+
+        Tiles with no such material get one registered, drawn like a wall or floor depending on blocks.
+        """
+        tile = int(tile[0]), int(tile[1])
+        if tile not in self.tiles:
+            if tile[0]:
+                self.register('tile{0}{1}'.format(*tile), tile[0], tile[1], 'wall', 'dark_wall')
+            else:
+                self.register('tile{0}{1}'.format(*tile), tile[0], tile[1], 'floor', 'dark_floor')
+        return self.tiles[tile]
+
+    def get_remap(self, names):
+        """Returns a translate table taking the IDs of a saved list of material names to the IDs used now.
+
+        Returns None if they're the same. Names no longer registered become walls.
+        """
+        table = bytearray(range(_SIZE))
+        for id, name in enumerate(names):
+            table[id] = self.names.get(name, WALL)
+        if table == bytearray(range(_SIZE)):
+            return None
+        return table
+
+    def get_names(self):
+        """Returns the list of material names, indexed by ID, as stored in save files."""
+        return [mat.name for mat in self.materials]
+
+
+# The palette every map uses.
+palette = Palette()
+
+WALL = palette.register('wall', 1, 1, 'wall', 'dark_wall')
+FLOOR = palette.register('floor', 0, 0, 'floor', 'dark_floor')
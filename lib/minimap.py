@@ -0,0 +1,125 @@
+import lib.material as material
+
+# Minimap shrinks a map and its FovMap's explored state down to a few cells, each standing for a square of scale by
+# scale tiles. A cell is UNEXPLORED, WALL if its only explored tiles are walls, or FLOOR if any explored tile is
+# walkable.
+#
+# Cells are worked out a band at a time, a band being the map rows behind one row of cells. The band's rows are turned
+# into long integers, one byte per tile, so that ANDing explored with walkable and ORing the rows together take a single
+# operation each; Cells are then read off the result with one search each. Bands are only redone when the FovMap's row
+# versions show a tile in them became explored since the last update, or the map was written to within them, so an
+# update with nothing new costs a single comparison.
+
+UNEXPLORED = 0
+WALL = 1
+FLOOR = 2
+
+
+def _to_int(row):
+    """Returns a byte string as one long integer."""
+    return int(str(row).encode('hex') or '0', 16)
+
+def _from_int(value, length):
+    """Returns a long integer made by L{_to_int} as a byte string of the given length."""
+    return ('%x' % value).zfill(length * 2).decode('hex')
+
+
+class Minimap(object):
+    """A w by h overview of a map's explored tiles, kept up to date with L{update}."""
+
+    def __init__(self, map, fov_map, w, h):
+        """Initialisation method; Listens to map for writes until L{close} is called.
+
+        @type  map: L{lib.map.Map}
+        @param map: Map shown, of any map type.
+        @type  fov_map: L{lib.fov.FovMap}
+        @param fov_map: Explored state of the map.
+        @type  w: number
+        @param w: Width in cells.
+        @type  h: number
+        @param h: Height in cells.
+        """
+        self.map = map
+        self.fov_map = fov_map
+        self.width = w
+        self.height = h
+        # the smallest square cells that fit the whole map in
+        self.scale = max(1, -(-map.width // w), -(-map.height // h))
+        self.cells = bytearray(w * h)
+        # FovMap version at the last update, -1 until the first one works out every band
+        self.fov_version = -1
+        self.dirty = set()
+        map.add_listener(self.changed)
+
+    def close(self):
+        """Stops listening to the map."""
+        self.map.remove_listener(self.changed)
+
+    def changed(self, x, y, w, h):
+        """Map listener, marks the bands holding the written rows to be redone."""
+        for band in range(max(y, 0) // self.scale, min((y + h - 1) // self.scale, self.height - 1) + 1):
+            self.dirty.add(band)
+
+    def get_cell(self, x, y):
+        """Returns the cell at (x,y), one of UNEXPLORED, WALL and FLOOR."""
+        return self.cells[y*self.width + x]
+
+    def get_pos(self, x, y):
+        """Returns the cell holding map tile (x,y)."""
+        return x // self.scale, y // self.scale
+
+    def update(self):
+        """Redoes the bands whose explored state or tiles changed; Returns the list of cell rows that changed."""
+        fov_map = self.fov_map
+        if fov_map.version == self.fov_version and not self.dirty:
+            return [ ]
+        row_versions = fov_map.row_versions
+        ret = [ ]
+        for band in range(self.height):
+            start = band * self.scale
+            end = min((band + 1) * self.scale, fov_map.h)
+            if start >= end:
+                break
+            if band in self.dirty or max(row_versions[start:end]) > self.fov_version:
+                if self.update_band(band):
+                    ret.append(band)
+        self.fov_version = fov_map.version
+        self.dirty.clear()
+        return ret
+
+    def update_band(self, band):
+        """Works out a row of cells; Returns True if any of them changed."""
+        scale = self.scale
+        map_width = self.fov_map.w
+        walkable = bytearray(256)
+        for id in range(256):
+            walkable[id] = not self.map.palette.blocks[id]
+        explored = 0
+        floor = 0
+        top = band * scale
+        bottom = min((band + 1) * scale, self.fov_map.h)
+        band_explored = self.fov_map.get_explored_rect(0, top, map_width, bottom - top)
+        for y in range(top, bottom):
+            k = (y - top) * map_width
+            row = _to_int(band_explored[k:k+map_width])
+            if not row:
+                continue
+            start, ids = self.map.get_rect(0, y, map_width, 1, view=True).get_row(0)
+            tiles = bytearray(chr(material.WALL) * map_width)
+            tiles[start:start+len(ids)] = ids
+            explored |= row
+            floor |= row & _to_int(tiles.translate(walkable))
+        explored = _from_int(explored, map_width)
+        floor = _from_int(floor, map_width)
+        cells = bytearray(self.width)
+        for i in range(self.width):
+            a, b = i * scale, (i + 1) * scale
+            if floor.find('\x01', a, b) != -1:
+                cells[i] = FLOOR
+            elif explored.find('\x01', a, b) != -1:
+                cells[i] = WALL
+        i = band * self.width
+        if cells == self.cells[i:i+self.width]:
+            return False
+        self.cells[i:i+self.width] = cells
+        return True
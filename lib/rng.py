@@ -0,0 +1,74 @@
+import random
+import hashlib
+
+
+class Stream(random.Random):
+    """A single seedable random stream, with helpers for drawing numbers in bulk.
+
+    Bulk helpers return lists, so hot loops can draw everything they need in one call.
+    """
+
+    def randints(self, a, b, count):
+        """Returns a list of count integers in [a, b]."""
+        rand = self.random
+        span = b - a + 1
+        return [a + int(rand() * span) for i in xrange(count)]
+
+    def randoms(self, count):
+        """Returns a list of count floats in [0, 1)."""
+        rand = self.random
+        return [rand() for i in xrange(count)]
+
+    def choices(self, seq, count):
+        """Returns a list of count elements picked from seq, with replacement."""
+        rand = self.random
+        size = len(seq)
+        return [seq[int(rand() * size)] for i in xrange(count)]
+
+    def chances(self, chance, count):
+        """Returns a list of count bools, each True with the given chance, a float in [0,1]."""
+        rand = self.random
+        return [rand() < chance for i in xrange(count)]
+
+
+class RNG(object):
+    """Named, independently seeded random streams.
+
+    Each stream's seed is derived from the master seed and the stream's name, so drawing more from one stream never
+    changes what another produces, and the same master seed always reproduces the same run. Streams are created on
+    first use; the engine uses 'mapgen', 'spawn', 'ai' and 'combat'.
+    """
+
+    def __init__(self, seed=None):
+        """Initialise with a master seed; A random one is picked if seed is None."""
+        self.lookup = { }
+        self.seed(seed)
+
+    def __getitem__(self, item):
+        return self.get_stream(item)
+
+    def __contains__(self, item):
+        return item in self.lookup
+
+    def seed(self, seed=None):
+        """Sets the master seed, and reseeds every existing stream from it."""
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        self.master_seed = seed
+        for name in self.lookup:
+            self.lookup[name].seed(self.get_seed(name))
+
+    def get_seed(self, name):
+        """Returns the seed a stream gets from the master seed."""
+        digest = hashlib.md5(str(self.master_seed) + ':' + name).hexdigest()
+        return int(digest[:16], 16)
+
+    def get_stream(self, name):
+        """Returns the named stream, creating it if needed."""
+        if name not in self.lookup:
+            self.lookup[name] = Stream(self.get_seed(name))
+        return self.lookup[name]
+
+    def seed_stream(self, name, seed):
+        """Seeds a single stream directly, detaching it from the master seed until L{seed} is called again."""
+        self.get_stream(name).seed(seed)
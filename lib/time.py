@@ -1,45 +1,207 @@
 
 from __future__ import absolute_import
+import heapq
+import json
 import time
 
+class Schedule(object):
+    """Handle for a single scheduled task.
+
+    Handles are looked up by id in the scheduler. Cancelling or rescheduling never searches the queue: the handle is
+    flagged as cancelled or given a new version, and any queue entry that no longer matches is dropped when it comes up.
+    """
+
+    def __init__(self, id, fct, args, delay):
+        self.id = id
+        self.fct = fct
+        self.args = args
+        self.delay = delay
+        self.due = None
+        self.version = 0
+        self.queued = False
+        self.cancelled = False
+
+    def run(self):
+        """Calls the scheduled function."""
+        self.fct(*self.args)
+
+
+class SchedulerStats(object):
+    """Timing and queue statistics gathered by a scheduler with instrumentation turned on.
+
+    callbacks maps (entity type, callback name) to [calls, total seconds, max seconds]; Entity type is the type string
+    of the object the callback is bound to, or its class name. Each tick that runs anything adds to the tick, task,
+    empty tick and queue depth counters.
+    """
+
+    def __init__(self):
+        self.callbacks = { }
+        self.ticks = 0
+        self.tasks = 0
+        self.max_tasks = 0
+        self.empty_ticks = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.tick_tasks = 0
+
+    def get_key(self, fct):
+        """Returns the (entity type, callback name) key for a scheduled function."""
+        owner = getattr(fct, '__self__', None)
+        name = getattr(fct, '__name__', repr(fct))
+        if owner is None:
+            return None, name
+        return getattr(owner, 'type', None) or owner.__class__.__name__, name
+
+    def start_tick(self, skipped, depth):
+        """Records a tick about to run, the number of empty ticks skipped to reach it, and the queue depth."""
+        self.ticks += 1
+        self.empty_ticks += skipped
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        self.tick_tasks = 0
+
+    def end_tick(self):
+        """Records the number of tasks run in the tick."""
+        self.tasks += self.tick_tasks
+        self.max_tasks = max(self.max_tasks, self.tick_tasks)
+
+    def run(self, handle):
+        """Runs a scheduled handle, timing it."""
+        start = time.time()
+        handle.run()
+        elapsed = time.time() - start
+        self.tick_tasks += 1
+        key = self.get_key(handle.fct)
+        if key not in self.callbacks:
+            self.callbacks[key] = [0, 0.0, 0.0]
+        record = self.callbacks[key]
+        record[0] += 1
+        record[1] += elapsed
+        if elapsed > record[2]:
+            record[2] = elapsed
+
+    def get_callback(self, type, name='update'):
+        """Returns (calls, total seconds, max seconds) for a callback, or None if it never ran."""
+        record = self.callbacks.get((type, name))
+        if record is None:
+            return None
+        return tuple(record)
+
+    def get_slowest(self, count=10):
+        """Returns a list of (entity type, callback name, calls, total seconds, max seconds), most total time first."""
+        ret = [key + tuple(record) for key, record in self.callbacks.iteritems()]
+        ret.sort(key=lambda item: item[3], reverse=True)
+        return ret[:count]
+
+    def get_queue(self):
+        """Returns a dict of the tick and queue counters."""
+        ticks = self.ticks or 1
+        return {
+            "ticks" : self.ticks,
+            "tasks" : self.tasks,
+            "tasks_per_tick" : float(self.tasks) / ticks,
+            "max_tasks_per_tick" : self.max_tasks,
+            "empty_ticks_skipped" : self.empty_ticks,
+            "depth" : self.depth,
+            "mean_depth" : float(self.total_depth) / ticks,
+            "max_depth" : self.max_depth
+        }
+
+    def save(self):
+        """Returns a dict of every statistic, in a JSON-friendly format."""
+        callbacks = [ ]
+        for type, name, calls, total, longest in self.get_slowest(len(self.callbacks)):
+            callbacks.append({"type" : type, "callback" : name, "calls" : calls, "total" : total, "max" : longest})
+        return {"queue" : self.get_queue(), "callbacks" : callbacks}
+
+    def dump(self, file):
+        """Writes every statistic to a JSON file.
+
+        @type  file: string
+        @param file: Filename of the file to write.
+        """
+        with open(file, 'w+') as f:
+            json.dump(self.save(), f, indent=1)
+
+
 class Scheduler:
     """Can schedule functions to be called a few ticks in the future.
 
-    If dominant id is not set, it'll stop on the first draw_tiles it finds. Queue's keys are update numbers, value is a list
-    containing tuples of the form (function, params, delay).
+    If dominant id is not set, it'll stop on the first draw_tiles it finds. Queue is a heap of entries of the form
+    (due tick, insertion order, handle, handle version); the insertion order keeps tasks due on the same tick running in
+    the order they were added. Entries left behind by cancelling or rescheduling are counted in stale, and the heap is
+    rebuilt without them once they make up most of it.
+
+    A budget set with L{set_budget} bounds how much one call to L{tick} may run. Entries of a tick cut short by it are
+    kept in pending, and run first on the next call.
     """
     def __init__(self):
         self.ticks = 0
-        self.queue = { }
+        self.queue = [ ]
         self.lookup = { }
         self.current_id = 0
+        self.order = 0
+        self.stale = 0
         self.dominant = None
+        self.stats = None
+        self.budget_tasks = None
+        self.budget_time = None
+        self.tasks_left = None
+        self.deadline = None
+        self.pending = [ ]
+        self.pending_done = False
 
-    def add_schedule(self, set, id=0):
-        """Returns the id you can use to cancel a scheduled task."""
-        if not id:
-            id = self.current_id
-            self.lookup[id] = set
-            self.current_id += 1
-        else:
-            for key in self.lookup:
-                if self.lookup[key] == set:
-                    id = key
-                    break
+    def set_budget(self, tasks=None, seconds=None):
+        """Limits how much a single call to L{tick} may run.
+
+        @type  tasks: number
+        @param tasks: Maximum number of tasks to run, or None for no limit.
+        @type  seconds: number
+        @param seconds: Maximum wall-clock time to run for, or None for no limit; Checked after every task.
+        """
+        self.budget_tasks = tasks
+        self.budget_time = seconds
+
+    def enable_stats(self):
+        """Turns instrumentation on, and returns the L{SchedulerStats} it fills in."""
+        if self.stats is None:
+            self.stats = SchedulerStats()
+        return self.stats
+
+    def disable_stats(self):
+        """Turns instrumentation off; Returns the statistics gathered so far, or None."""
+        stats = self.stats
+        self.stats = None
+        return stats
+
+    def add_schedule(self, set):
+        """Schedules a tuple of the form (function, params, delay); Returns the id you can use to cancel it."""
         fct, args, delay = set
-        if self.ticks + delay not in self.queue:
-            self.queue[self.ticks + delay] = []
-        self.queue[self.ticks + delay].append(set)
+        id = self.current_id
+        self.current_id += 1
+        handle = Schedule(id, fct, args, delay)
+        self.lookup[id] = handle
+        self._push(handle, self.ticks + delay)
         return id
 
+    def get_schedule(self, id):
+        """Returns the handle for a scheduled task, or None."""
+        return self.lookup.get(id)
+
     def cancel_schedule(self, id):
         """Cancels a schedule from running."""
-        for tick in self.queue:
-            sets = self.queue[tick]
-            for set in sets:
-                if self.lookup[id] == set:
-                    sets.remove(set)
-        del self.lookup[id]
+        handle = self.lookup.pop(id)
+        handle.cancelled = True
+        self._discard(handle)
+
+    def reschedule(self, id, delay):
+        """Changes the delay of a scheduled task, and moves it to run that many ticks from now; Keeps its id."""
+        handle = self.lookup[id]
+        self._discard(handle)
+        handle.delay = delay
+        self._push(handle, self.ticks + delay)
 
     def set_dominant(self,id):
         """Call with None in order to stop every useful update."""
@@ -48,24 +210,391 @@ class Scheduler:
         else:
             self.dominant = None
 
+    def _push(self, handle, due):
+        """Adds a handle to the queue, due on the given tick."""
+        handle.due = due
+        handle.queued = True
+        heapq.heappush(self.queue, (due, self.order, handle, handle.version))
+        self.order += 1
+
+    def _discard(self, handle):
+        """Marks the handle's current queue entry as stale."""
+        handle.version += 1
+        if not handle.queued:
+            return
+        handle.queued = False
+        self.stale += 1
+        if self.stale > len(self.queue) / 2:
+            self.queue = [entry for entry in self.queue if self._live(entry)]
+            heapq.heapify(self.queue)
+            self.stale = 0
+
+    def _live(self, entry):
+        handle = entry[2]
+        return not handle.cancelled and entry[3] == handle.version
+
+    def _pop_due(self, limit=None):
+        """Jumps straight to the first tick with anything due, and returns every (handle, version) entry due on it.
+
+        Returns an empty list if the queue is empty, or nothing is due before limit.
+        """
+        queue = self.queue
+        while queue and not self._live(queue[0]):
+            heapq.heappop(queue)
+            self.stale -= 1
+        if not queue or (limit is not None and queue[0][0] >= limit):
+            return [ ]
+        due = queue[0][0]
+        entries = [ ]
+        while queue and queue[0][0] == due:
+            entry = heapq.heappop(queue)
+            if self._live(entry):
+                entry[2].queued = False
+                entries.append((entry[2], entry[3]))
+            else:
+                self.stale -= 1
+        self.ticks = due + 1
+        return entries
+
+    def _requeue(self, handle):
+        """Queues a handle again after it has run, unless it was moved or cancelled while running."""
+        if not handle.cancelled and not handle.queued:
+            self._push(handle, self.ticks + handle.delay)
+
+    def _run(self, entries):
+        """Runs the entries returned by L{_pop_due}; Returns True if the dominant task ran."""
+        ran_dominant = False
+        stats = self.stats
+        for index, (handle, version) in enumerate(entries):
+            # a task earlier in this tick may have cancelled or moved this one
+            if handle.cancelled or handle.version != version:
+                continue
+            if stats is None:
+                handle.run()
+            else:
+                stats.run(handle)
+            self._requeue(handle)
+            if self.dominant is handle:
+                ran_dominant = True
+            if self._spend(1):
+                self.pending = entries[index + 1:]
+                break
+        return ran_dominant
+
+    def _spend(self, tasks):
+        """Takes a number of tasks run off the budget; Returns True if it has run out."""
+        if self.tasks_left is not None:
+            self.tasks_left -= tasks
+            if self.tasks_left <= 0:
+                return True
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def _out_of_budget(self):
+        if self.tasks_left is not None and self.tasks_left <= 0:
+            return True
+        return self.deadline is not None and self.clock() >= self.deadline
+
     def tick(self):
         """Find the first useful update, then run everything in it; If one of the run functions was the dominant or
-        dominant is None, stop after this, otherwise keep going."""
-        done = 0
-        while not done:
-            sets = []
-            while sets == [] and self.queue != {}:
-                sets = self.queue.pop(self.ticks,[])
-                self.ticks += 1
-            for set in sets:
-                # run the function
-                set[0](*set[1])
-                self.add_schedule(set,set[2])
-                if self.dominant == set:
-                    done = 1
-            if self.dominant is None:
-                done = 1
+        dominant is None, stop after this, otherwise keep going.
+
+        A cancelled dominant counts as None. Returns True when done; If the budget runs out first, returns False, and
+        the next call carries on from the same point.
+        """
+        self.tasks_left = self.budget_tasks
+        if self.budget_time is not None:
+            self.deadline = self.clock() + self.budget_time
+        done = bool(self.pending) and self.pending_done
+        exhausted = False
+        while 1:
+            ran_dominant = self._step()
+            if ran_dominant is None:
+                # nothing left to run, the dominant can't come up again
+                break
+            if ran_dominant or self.dominant is None or self.dominant.cancelled:
+                done = True
+            if self.pending:
+                exhausted = True
+                break
+            if done:
+                break
+            if self._out_of_budget():
+                exhausted = True
+                break
+        self.pending_done = done
+        self.tasks_left = None
+        self.deadline = None
+        return not exhausted
+
+    def step(self, limit=None):
+        """Runs the next tick with anything due before limit, ignoring the dominant; Returns True if one ran."""
+        return self._step(limit) is not None
+
+    def advance(self, ticks):
+        """Runs everything due in the next few ticks, ignoring the dominant, and leaves the clock after them.
+
+        @type  ticks: number
+        @param ticks: Number of ticks to move forward.
+        @rtype: number
+        @return: Number of ticks that had anything to run.
+        """
+        limit = self.ticks + ticks
+        ran = 0
+        while self._step(limit) is not None:
+            ran += 1
+        if self.ticks < limit:
+            # nothing is due before limit, so no turn of the wheel gets skipped over
+            self.ticks = limit
+        return ran
+
+    def _step(self, limit=None):
+        """Runs the next tick with anything due before limit; Returns None if nothing was, otherwise whether the
+        dominant ran."""
+        stats = self.stats
+        if self.pending:
+            # finish the tick a budget cut short; Its tasks keep adding to the same tick's count
+            entries = self.pending
+            self.pending = [ ]
+            ran_dominant = self._run(entries)
+            if stats is not None and not self.pending:
+                stats.end_tick()
+            return ran_dominant
+        start = self.ticks
+        entries = self._pop_due(limit)
+        if not entries:
+            return None
+        if stats is None:
+            return self._run(entries)
+        stats.start_tick(self.ticks - 1 - start, len(self.lookup))
+        ran_dominant = self._run(entries)
+        if not self.pending:
+            stats.end_tick()
+        return ran_dominant
 
     def sleep(self,sec):
         time.sleep(sec)
-                
\ No newline at end of file
+
+    def clock(self):
+        """Returns wall-clock time in seconds."""
+        return time.time()
+
+
+class FixedStep(object):
+    """Maps wall-clock time to scheduler ticks at a fixed rate, for real-time play.
+
+    Time passed builds up in accumulator, and every frame pays it off in whole ticks, but never more than max_steps at
+    once; Whatever is owed beyond that is dropped and counted in dropped, so a slow frame costs at most max_steps ticks
+    of catch-up instead of a spiral of death. Rendering runs at its own render_rate, or every frame if None.
+    """
+
+    def __init__(self, rate, max_steps=5, render_rate=None, clock=time.time):
+        """Initialisation method.
+
+        @type  rate: number
+        @param rate: Scheduler ticks per second.
+        @type  max_steps: number
+        @param max_steps: Most ticks to run in a single frame.
+        @type  render_rate: number
+        @param render_rate: Frames drawn per second, or None to draw every frame.
+        @type  clock: function
+        @param clock: Function returning the time in seconds.
+        """
+        self.rate = rate
+        self.step = 1.0 / rate
+        self.max_steps = max_steps
+        self.render_rate = render_rate
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """Forgets any time owed, for instance after a pause."""
+        self.accumulator = 0.0
+        self.dropped = 0
+        self.last = self.clock()
+        self.last_render = None
+
+    def get_steps(self):
+        """Returns the number of ticks to run this frame."""
+        now = self.clock()
+        self.accumulator += now - self.last
+        self.last = now
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            self.dropped += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator %= self.step
+        else:
+            self.accumulator -= steps * self.step
+        return steps
+
+    def get_alpha(self):
+        """Returns how far into the next tick the clock is, in [0, 1), for interpolated drawing."""
+        return self.accumulator / self.step
+
+    def get_render(self):
+        """Returns True if a frame should be drawn now."""
+        if self.render_rate is None:
+            return True
+        now = self.clock()
+        if self.last_render is not None and now - self.last_render < 1.0 / self.render_rate:
+            return False
+        self.last_render = now
+        return True
+
+    def get_idle(self):
+        """Returns the seconds left until the next tick or frame is due."""
+        now = self.clock()
+        idle = self.step - self.accumulator - (now - self.last)
+        if self.render_rate is not None and self.last_render is not None:
+            idle = min(idle, 1.0 / self.render_rate - (now - self.last_render))
+        return max(idle, 0.0)
+
+
+class Bucket(object):
+    """Entries of tasks sharing a delay that are due on the same tick; Moved along the wheel as one."""
+
+    def __init__(self, due, delay):
+        self.due = due
+        self.delay = delay
+        self.entries = [ ]
+
+
+class WheelScheduler(Scheduler):
+    """Scheduler mode that keeps tasks sharing a delay in one bucket, filed on a hierarchical timing wheel.
+
+    Suits large populations on the same cadence, such as entities added with the default delay: once a bucket has run,
+    it is moved to its next due tick as a whole, so the cost of scheduling doesn't grow with the number of tasks in it.
+    Level 0 of the wheel has a slot per tick, each further level has slots spanning a full turn of the level below, and
+    buckets drop down a level as their turn comes up. Buckets due further out than the whole wheel sit in the top
+    level until they fit. Buckets due on the same tick run one after the other, in the order they were filed.
+    """
+
+    bits = 6
+    levels = 4
+
+    def __init__(self):
+        Scheduler.__init__(self)
+        self.size = 1 << self.bits
+        self.mask = self.size - 1
+        self.wheel = [[[ ] for i in range(self.size)] for j in range(self.levels)]
+        self.counts = [0] * self.levels
+        self.buckets = { }
+
+    def _push(self, handle, due):
+        """Adds a handle to the bucket for its delay, due on the given tick."""
+        handle.due = due
+        handle.queued = True
+        key = (due, handle.delay)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(due, handle.delay)
+            self._insert(bucket)
+        bucket.entries.append((handle, handle.version))
+
+    def _discard(self, handle):
+        """Marks the handle's current bucket entry as stale; Stale entries are dropped when their bucket next runs."""
+        handle.version += 1
+        handle.queued = False
+
+    def _requeue(self, handle):
+        """Nothing to do, the handle's bucket was already moved on before running."""
+        pass
+
+    def _insert(self, bucket):
+        """Files a bucket into the wheel slot for its due tick."""
+        delta = bucket.due - self.ticks
+        level = 0
+        while level < self.levels - 1 and delta >> (self.bits * (level + 1)):
+            level += 1
+        self.wheel[level][(bucket.due >> (self.bits * level)) & self.mask].append(bucket)
+        self.counts[level] += 1
+
+    def _cascade(self):
+        """Drops the buckets of the turns that start on the current tick down the wheel."""
+        top = 1
+        while top < self.levels - 1 and not self.ticks & ((1 << (self.bits * (top + 1))) - 1):
+            top += 1
+        for level in range(top, 0, -1):
+            index = (self.ticks >> (self.bits * level)) & self.mask
+            buckets = self.wheel[level][index]
+            self.wheel[level][index] = [ ]
+            self.counts[level] -= len(buckets)
+            for bucket in buckets:
+                self._insert(bucket)
+
+    def _move_to(self, tick):
+        """Moves the wheel forward to tick; Nothing may be due between the current tick and it."""
+        self.ticks = tick
+        if not tick & self.mask:
+            self._cascade()
+
+    def _advance(self, limit=None):
+        """Moves the wheel forward to the next tick with a bucket due, without going past limit.
+
+        Turns of the wheel with nothing in them are skipped whole. Returns the tick reached, or None if nothing is due
+        before limit.
+        """
+        if limit is not None and self.ticks >= limit:
+            return None
+        slots = self.wheel[0]
+        while not slots[self.ticks & self.mask]:
+            if self.counts[0]:
+                # scan the rest of this turn of level 0
+                start = self.ticks & self.mask
+                target = (self.ticks | self.mask) + 1
+                for index in range(start + 1, self.size):
+                    if slots[index]:
+                        target = self.ticks - start + index
+                        break
+            else:
+                level = 1
+                while level < self.levels and not self.counts[level]:
+                    level += 1
+                if level == self.levels:
+                    return None
+                shift = self.bits * level
+                target = ((self.ticks >> shift) + 1) << shift
+            if limit is not None and target >= limit:
+                if limit > self.ticks:
+                    self._move_to(limit)
+                return None
+            self._move_to(target)
+        return self.ticks
+
+    def _pop_due(self, limit=None):
+        """Runs the wheel to the first tick with anything due, moves its buckets on, and returns their live entries.
+
+        Ticks whose buckets only hold stale entries are skipped like empty ones. Stops at limit, if given.
+        """
+        entries = [ ]
+        while not entries:
+            due = self._advance(limit)
+            if due is None:
+                return [ ]
+            index = due & self.mask
+            buckets = self.wheel[0][index]
+            self.wheel[0][index] = [ ]
+            self.counts[0] -= len(buckets)
+            self._move_to(due + 1)
+            entries = self._rotate(buckets)
+        return entries
+
+    def _rotate(self, buckets):
+        """Moves buckets that just came due on to their next due tick; Returns their live entries."""
+        entries = [ ]
+        for bucket in buckets:
+            del self.buckets[(bucket.due, bucket.delay)]
+            live = [entry for entry in bucket.entries if not entry[0].cancelled and entry[0].version == entry[1]]
+            if not live:
+                continue
+            entries += live
+            # rotate the whole bucket to its next due tick
+            bucket.entries = list(live)
+            bucket.due = self.ticks + bucket.delay
+            key = (bucket.due, bucket.delay)
+            if key in self.buckets:
+                self.buckets[key].entries += bucket.entries
+            else:
+                self.buckets[key] = bucket
+                self._insert(bucket)
+        return entries
@@ -0,0 +1,307 @@
+import os
+import json
+import zlib
+import base64
+import shutil
+import tempfile
+
+import lib.map as map
+import lib.fov as fov
+import lib.material as material
+import lib.rng as rng
+
+# A World is a single map much larger than anything generated up front. Its tiles are kept in chunks, like a
+# ChunkedMap's, and each chunk is laid out from the block library the first time the camera comes near it. Chunks the
+# camera leaves far behind are written to a file, along with the entities and explored state on them, and dropped from
+# memory; They're read back in when the camera returns. The map's grid and the application's ChunkedFovMap are chunked
+# the same way, so memory follows the area around the camera, not the area explored.
+#
+# Every chunk is generated from its own random stream, seeded from the master seed and the chunk's position, so the
+# same seed makes the same world whatever order it's explored in. Neighbouring chunks are joined by a corridor through
+# a portal on the edge they share, placed from a stream of that edge's own.
+
+
+class WorldMap(map.ChunkedMap):
+    """The map of a L{World}; Its chunks are the ones the world generates, loads and unloads."""
+
+    chunk_bits = 6
+
+
+class ChunkGenerator(map.BlockGenerator):
+    """Lays blocks out from a starting block, within a map the size of one chunk.
+
+    Unlike L{lib.map.BlockGenerator.gen_map}, a single attempt is made, and the end block needn't be placed.
+    """
+
+    def gen_map(self):
+        """Returns the chunk's map; start_pos is the first floor tile of its starting block."""
+        self.map.clear()
+        self.entities = [ ]
+        self.clear_rects()
+        block = self.layout['start']
+        self.finish_block = self.layout['end']
+        self.finished = False
+        x = self.rng.randint(1, max(1, self.width - self.block_widths[block] - 1))
+        y = self.rng.randint(1, max(1, self.height - self.block_heights[block] - 1))
+        self.start_pos = self.get_floor(x, y, block)
+        self._recurse_gen(x, y, block)
+        return self.map
+
+
+class World(object):
+    """Streams the chunks of a L{WorldMap} in and out around the application's camera.
+
+    Chunks within radius chunks of the camera's are kept loaded, and those further than keep chunks are unloaded. The
+    camera's chunk and the ones touching it are made as soon as they're needed; Further ones are generated at most
+    per_update at a time, nearest first, so that generation is spread over the updates spent walking towards them.
+    """
+
+    def __init__(self, app, size=1024, layout='test', radius=2, keep=4, per_update=1, path=None):
+        """Initialisation method.
+
+        @type  app: L{lib.base.Application}
+        @param app: Application whose camera is followed, and whose entities are stored with their chunks.
+        @type  size: number
+        @param size: Width and height of the world, in tiles; Rounded down to whole chunks.
+        @type  layout: str
+        @param layout: Filename of layout file to generate chunks with.
+        @type  radius: number
+        @param radius: Distance in chunks from the camera's chunk within which chunks are loaded.
+        @type  keep: number
+        @param keep: Distance in chunks from the camera's chunk past which chunks are unloaded.
+        @type  per_update: number
+        @param per_update: Most chunks beyond those touching the camera's generated in one update.
+        @type  path: str
+        @param path: Directory for unloaded chunks, or None for a temporary one.
+        """
+        self.app = app
+        self.radius = radius
+        self.keep = max(keep, radius + 1)
+        self.per_update = per_update
+        self.path = path
+        self.temp_path = None
+        self.map = None
+        self.layout = layout
+        self.chunk_size = 1 << WorldMap.chunk_bits
+        self.chunk_count = size >> WorldMap.chunk_bits
+        # a copy of the master seed, saved with the world so chunks made after loading still fit with the stored ones
+        self.rng = rng.RNG(app.rng.master_seed)
+        # the chunk the world starts from, the only one with a player_spawn
+        self.origin = (self.chunk_count // 2, self.chunk_count // 2)
+        self.generator = ChunkGenerator(self.chunk_size, self.chunk_size)
+        self.generator.set_layout(layout)
+        self.loaded = set()
+        # chunk to the IDs of the entities stored with it, for every unloaded chunk
+        self.stored = { }
+
+    def get_chunk(self, x, y):
+        """Returns the (column, row) of the chunk holding a position."""
+        return x >> WorldMap.chunk_bits, y >> WorldMap.chunk_bits
+
+    def get_stream(self, name):
+        """Returns a new random stream, seeded from the master seed and name."""
+        return rng.Stream(self.rng.get_seed('world:' + name))
+
+    def start(self):
+        """Makes a new world's map the application's, with the chunk at its centre generated; Returns the map.
+
+        The centre chunk's starting block has a player_spawn, so L{lib.base.Application.place_player} can be used.
+        """
+        self.clear()
+        self.map = WorldMap(self.chunk_count << WorldMap.chunk_bits, self.chunk_count << WorldMap.chunk_bits)
+        self.app.add_map(self.map)
+        self.generate_chunk(self.origin)
+        return self.map
+
+    def update(self):
+        """Loads and generates the chunks around the camera, and unloads the far ones; Call once per update."""
+        if self.map is None or not self.app.camera:
+            return
+        cx, cy = self.get_chunk(*self.app.entity_manager.get_abs_pos(self.app.camera))
+        near = [ ]
+        for i in range(max(cx - self.radius, 0), min(cx + self.radius + 1, self.chunk_count)):
+            for j in range(max(cy - self.radius, 0), min(cy + self.radius + 1, self.chunk_count)):
+                if (i, j) not in self.loaded:
+                    near.append((max(abs(i - cx), abs(j - cy)), i, j))
+        generated = 0
+        for dist, i, j in sorted(near):
+            if (i, j) in self.stored:
+                self.load_chunk((i, j))
+            elif dist <= 1 or generated < self.per_update:
+                self.generate_chunk((i, j))
+                generated += dist > 1
+        far = [key for key in self.loaded if max(abs(key[0] - cx), abs(key[1] - cy)) > self.keep]
+        if far:
+            self.unload_chunks(far)
+
+    def generate_chunk(self, key):
+        """Lays out a chunk from the block library, spawns its entities, and joins it up with its neighbours.
+
+        Every chunk's starting and end blocks may have player_spawn spawners; Only the origin chunk keeps them.
+        """
+        cx, cy = key
+        ox, oy = cx << WorldMap.chunk_bits, cy << WorldMap.chunk_bits
+        gen = self.generator
+        gen.rng = self.get_stream('{0},{1}'.format(cx, cy))
+        gen.gen_map()
+        self.map.copy_region(gen.map, 0, 0, self.chunk_size, self.chunk_size, ox, oy)
+        start_x, start_y = gen.start_pos[0] + ox, gen.start_pos[1] + oy
+        last = self.chunk_size - 1
+        # a portal on each edge shared with another chunk, and a corridor from it to the starting block
+        portals = [ ]
+        if cx > 0:
+            portals.append((ox, oy + self.get_portal('v', cx, cy), True))
+        if cx < self.chunk_count - 1:
+            portals.append((ox + last, oy + self.get_portal('v', cx+1, cy), True))
+        if cy > 0:
+            portals.append((ox + self.get_portal('h', cx, cy), oy, False))
+        if cy < self.chunk_count - 1:
+            portals.append((ox + self.get_portal('h', cx, cy+1), oy + last, False))
+        for x, y, across in portals:
+            if across:
+                self.map.fill_rect(min(x, start_x), y, abs(x - start_x) + 1, 1, material.FLOOR)
+                self.map.fill_rect(start_x, min(y, start_y), 1, abs(y - start_y) + 1, material.FLOOR)
+            else:
+                self.map.fill_rect(x, min(y, start_y), 1, abs(y - start_y) + 1, material.FLOOR)
+                self.map.fill_rect(min(x, start_x), start_y, abs(x - start_x) + 1, 1, material.FLOOR)
+        ents = [(ent[0] + ox, ent[1] + oy) + ent[2:] for ent in gen.entities
+                if key == self.origin or ent[3] != 'player_spawn']
+        self.app.generate_ents(self.map, ents)
+        self.loaded.add(key)
+
+    def get_portal(self, kind, cx, cy):
+        """Returns the offset along a chunk edge of the portal through it.
+
+        Edges are named after the chunk to their right or below, with kind 'v' for vertical edges and 'h' for
+        horizontal ones, so the chunks on either side agree.
+        """
+        return self.get_stream('{0}{1},{2}'.format(kind, cx, cy)).randint(2, self.chunk_size - 3)
+
+    def get_partition(self, keys):
+        """Returns a dict of each of the given chunks to the IDs of the entities on it.
+
+        An entity is on the chunk its top container is on; The player, the camera and their contents aren't on any.
+        """
+        entity_manager = self.app.entity_manager
+        travelling = set((entity_manager.garbage_id, self.app.player, self.app.camera))
+        ret = dict((key, [ ]) for key in keys)
+        for id in entity_manager:
+            top = entity_manager.get_ancestor(id)
+            if top in travelling:
+                continue
+            pos = entity_manager.positions.get(top)
+            if pos is not None and self.get_chunk(*pos) in ret:
+                ret[self.get_chunk(*pos)].append(id)
+        return ret
+
+    def unload_chunks(self, keys):
+        """Writes chunks and the entities on them to files, and drops them from memory.
+
+        Entities stored away keep their IDs reserved in the EntityManager, so they come back unchanged. So does the
+        explored state, if the application keeps a L{lib.fov.ChunkedFovMap}.
+        """
+        entity_manager = self.app.entity_manager
+        fov_map = self.app.fov_map if isinstance(self.app.fov_map, fov.ChunkedFovMap) else None
+        for key, ids in self.get_partition(keys).iteritems():
+            ents = { }
+            for id in ids:
+                ents[id] = entity_manager.get_record(id)
+            for id in ids:
+                entity_manager.remove_entity(id)
+            entity_manager.reserved.update(ents)
+            chunk = self.map.set_chunk(key[0], key[1], None)
+            data = {"materials": self.map.palette.get_names(), "ents": ents}
+            if chunk is not None:
+                data["tiles"] = base64.b64encode(str(chunk))
+            explored = fov_map.set_chunk(key[0], key[1], None) if fov_map is not None else None
+            if explored is not None:
+                data["explored"] = base64.b64encode(str(explored))
+            with open(self.get_file(key), 'wb') as f:
+                f.write(zlib.compress(json.dumps(data)))
+            self.loaded.discard(key)
+            self.stored[key] = set(ents)
+
+    def load_chunk(self, key):
+        """Reads an unloaded chunk and its entities back in, and removes its file."""
+        path = self.get_file(key)
+        with open(path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+        if "tiles" in data:
+            chunk = bytearray(base64.b64decode(data["tiles"]))
+            remap = self.map.palette.get_remap(data["materials"])
+            if remap is not None:
+                chunk = chunk.translate(remap)
+            self.map.set_chunk(key[0], key[1], chunk)
+        if "explored" in data and isinstance(self.app.fov_map, fov.ChunkedFovMap):
+            self.app.fov_map.set_chunk(key[0], key[1], bytearray(base64.b64decode(data["explored"])))
+        entity_manager = self.app.entity_manager
+        entity_manager.reserved.difference_update(self.stored.pop(key))
+        ents = data["ents"]
+        for id in sorted(ents, key=int):
+            entity_manager.load_record(int(id), ents[id])
+        os.remove(path)
+        self.loaded.add(key)
+
+    def save(self):
+        """Returns a dict of the world's state in save format, ready for JSON.
+
+        The map and the entities on loaded chunks are saved by the application as usual; This holds the rest: The
+        world's settings and seed, which chunks are loaded, and the contents of every unloaded chunk's file.
+        """
+        stored = { }
+        for key, ids in self.stored.iteritems():
+            with open(self.get_file(key), 'rb') as f:
+                stored['{0},{1}'.format(*key)] = {"ids": sorted(ids), "data": base64.b64encode(f.read())}
+        return {"size": self.chunk_count << WorldMap.chunk_bits, "layout": self.layout, "radius": self.radius,
+                "keep": self.keep, "per_update": self.per_update, "seed": self.rng.master_seed,
+                "loaded": sorted(self.loaded), "stored": stored}
+
+    def load(self, data, map_data):
+        """Makes a saved world's map the application's, and writes its unloaded chunks back to files; Returns the map.
+
+        @type  data: dict
+        @param data: The world's state, as returned by L{save} and parsed from JSON.
+        @type  map_data: dict
+        @param map_data: The world's map, in save format, as parsed from JSON.
+        """
+        self.clear()
+        self.rng.seed(data["seed"])
+        self.map = WorldMap(self.chunk_count << WorldMap.chunk_bits, self.chunk_count << WorldMap.chunk_bits)
+        self.map.load(map_data)
+        self.app.add_map(self.map)
+        self.loaded = set(tuple(key) for key in data["loaded"])
+        entity_manager = self.app.entity_manager
+        for name, chunk in data["stored"].iteritems():
+            cx, cy = name.split(",",1)
+            key = int(cx), int(cy)
+            with open(self.get_file(key), 'wb') as f:
+                f.write(base64.b64decode(chunk["data"]))
+            self.stored[key] = set(chunk["ids"])
+            entity_manager.reserved.update(chunk["ids"])
+        return self.map
+
+    def get_file(self, key):
+        """Returns the path of an unloaded chunk's file."""
+        return os.path.join(self.get_path(), "{0}_{1}.chunk".format(*key))
+
+    def get_path(self):
+        """Returns the directory unloaded chunks go in, creating it if needed."""
+        if self.path is not None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            return self.path
+        if self.temp_path is None:
+            self.temp_path = tempfile.mkdtemp(prefix='world')
+        return self.temp_path
+
+    def clear(self):
+        """Forgets every chunk, deleting unloaded chunks' files."""
+        entity_manager = self.app.entity_manager
+        for key, ids in self.stored.iteritems():
+            os.remove(self.get_file(key))
+            entity_manager.reserved.difference_update(ids)
+        self.stored.clear()
+        self.loaded.clear()
+        if self.temp_path is not None:
+            shutil.rmtree(self.temp_path, True)
+            self.temp_path = None
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The engine is imported as lib.*, and reads its data files from paths relative to the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Applications open a window through pygame; Without a display, SDL's dummy drivers stand in.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def block_library():
+    """Generates the block library from data/map/raw_blocks if a fresh checkout doesn't have it yet."""
+    blocks = os.path.join(ROOT, 'data', 'map', 'blocks')
+    if not any(name.endswith('.block') for name in os.listdir(blocks)):
+        subprocess.check_call([sys.executable, 'generate_blocks.py'], cwd=os.path.dirname(blocks))
+
+
+@pytest.fixture(autouse=True)
+def root_dir(monkeypatch):
+    """Runs every test from the repository root."""
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def app():
+    """An Application with master seed 1 and no map yet; Skips the test when pygame isn't installed."""
+    pytest.importorskip('pygame')
+    import lib.base as base
+    application = base.Application('test', 80, 50, 1)
+    yield application
+    application.destroy_ents()
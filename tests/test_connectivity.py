@@ -0,0 +1,50 @@
+import random
+
+import lib.map as map
+import lib.material as material
+
+W, H = 60, 40
+
+
+def ref_labels(mp):
+    """Returns a dict of every walkable tile to the number of its 4-connected area, found by a plain search."""
+    labels = { }
+    count = 0
+    for y in range(H):
+        for x in range(W):
+            if mp.get_blocking(x, y) or (x, y) in labels:
+                continue
+            count += 1
+            labels[x, y] = count
+            stack = [(x, y)]
+            while stack:
+                a, b = stack.pop()
+                for c, d in ((a+1, b), (a-1, b), (a, b+1), (a, b-1)):
+                    if 0 <= c < W and 0 <= d < H and (c, d) not in labels and not mp.get_blocking(c, d):
+                        labels[c, d] = count
+                        stack.append((c, d))
+    return labels
+
+
+def test_reachability_matches_search():
+    r = random.Random(11)
+    for cls in (map.Map, map.ChunkedMap, map.MappedMap):
+        mp = cls(W, H)
+        for k in range(30):
+            mp.fill_rect(r.randint(0, W), r.randint(0, H), r.randint(1, 10), r.randint(1, 10), material.FLOOR)
+        mp.get_connectivity()
+        for it in range(200):
+            # mostly single tiles, which are added in place; Walls and rects make the labels rebuild
+            if r.random() < 0.85:
+                id = material.FLOOR if r.random() < 0.8 else material.WALL
+                mp.set_material(r.randint(0, W), r.randint(0, H), id)
+            else:
+                mp.fill_rect(r.randint(0, W), r.randint(0, H), r.randint(1, 5), r.randint(1, 5), r.randint(0, 1))
+            if it % 10:
+                continue
+            labels = ref_labels(mp)
+            points = [(r.randint(-1, W), r.randint(-1, H)) for i in range(40)] + r.sample(sorted(labels), 40)
+            for a in points:
+                for b in points[:20]:
+                    expected = a in labels and b in labels and labels[a] == labels[b]
+                    assert mp.is_reachable(a, b) == expected, (cls, it, a, b)
@@ -0,0 +1,75 @@
+import random
+
+import lib.map as map
+import lib.material as material
+
+W, H = 100, 80
+
+
+def check(mp, grid, blocking, opaque):
+    """Checks every tile of a grid against the map's flags and counts of blocking and opaque entities."""
+    for y in range(-2, H+2):
+        for x in range(-2, W+2):
+            assert bool(grid.get_blocking(x, y)) == bool(mp.get_blocking(x, y) or blocking.get((x, y))), (x, y)
+            assert bool(grid.get_blocking_light(x, y)) == bool(mp.get_blocking_light(x, y) or opaque.get((x, y))), (x, y)
+    rect = grid.get_light_rect(-3, -3, W+6, H+6)
+    assert rect == bytearray(int(bool(grid.get_blocking_light(x, y))) for y in range(-3, H+3) for x in range(-3, W+3))
+
+
+def test_counts_match_map_and_entities():
+    r = random.Random(3)
+    for cls in (map.Map, map.ChunkedMap):
+        mp = cls(W, H)
+        mp.fill_rect(1, 1, 40, 30, material.FLOOR)
+        mp.fill_rect(60, 50, 30, 20, material.FLOOR)
+        grid = mp.get_grid()
+        blocking = { }
+        opaque = { }
+        placed = [ ]
+        for it in range(1500):
+            op = r.random()
+            if op < 0.4:
+                pos = r.randint(-1, W), r.randint(-1, H)
+                flags = r.random() < 0.5, r.random() < 0.5
+                grid.add(pos, *flags)
+                placed.append((pos, flags))
+                for flag, counts in zip(flags, (blocking, opaque)):
+                    if flag:
+                        counts[pos] = counts.get(pos, 0) + 1
+            elif op < 0.7 and placed:
+                pos, flags = placed.pop(r.randrange(len(placed)))
+                grid.remove(pos, *flags)
+                for flag, counts in zip(flags, (blocking, opaque)):
+                    if flag:
+                        counts[pos] -= 1
+            elif op < 0.95:
+                mp.set_material(r.randint(0, W), r.randint(0, H), r.randint(0, 1))
+            else:
+                mp.fill_rect(r.randint(-5, W), r.randint(-5, H), r.randint(1, 30), r.randint(1, 30), r.randint(0, 1))
+        check(mp, grid, blocking, opaque)
+        mp.flood_fill(5, 5, material.WALL)
+        check(mp, grid, blocking, opaque)
+
+
+def test_grid_follows_entities(app):
+    r = random.Random(3)
+    for cls in (map.Map, map.ChunkedMap):
+        mp = cls(W, H)
+        mp.fill_rect(1, 1, 40, 30, material.FLOOR)
+        app.add_map(mp)
+        grid = mp.get_grid()
+        for i in range(60):
+            app.add_entity(r.randint(1, 39), r.randint(1, 29), r.choice(['kobold', 'door', 'boulder', 'item']))
+        app.simulate(100)
+        mp.fill_rect(30, 20, 40, 40, material.FLOOR)
+        app.simulate(50)
+        em = app.entity_manager
+        blocking = { }
+        opaque = { }
+        for id in em:
+            pos = em.positions.get(id)
+            if pos is not None:
+                blocking[tuple(pos)] = blocking.get(tuple(pos)) or em[id].get_attribute('blocking')
+                opaque[tuple(pos)] = opaque.get(tuple(pos)) or em[id].get_attribute('opaque')
+        check(mp, grid, blocking, opaque)
+        app.destroy_ents()
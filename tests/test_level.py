@@ -0,0 +1,54 @@
+import lib.fov as fov
+
+
+def snapshot(app):
+    """Returns the active level's tiles, and every entity's ID, position and type."""
+    em = app.entity_manager
+    tiles = [app.map.get_material(x, y) for y in range(app.map.height) for x in range(app.map.width)]
+    return tiles, sorted((id, tuple(em.get_pos(id) or ()), str(em[id].type)) for id in em)
+
+
+def make_levels(app):
+    """Generates three levels, exploring a tile on each; Returns their snapshots, with 'b' left active."""
+    app.levels.max_loaded = 1
+    app.generate_map(100, 100, True)
+    app.place_player(10)
+    app.fov_map.set_explored(5, 5)
+    snapshots = {None: snapshot(app)}
+    app.change_level('a', 100, 100)
+    app.fov_map.set_explored(7, 7)
+    snapshots['a'] = snapshot(app)
+    app.change_level('b', 100, 100)
+    snapshots['b'] = snapshot(app)
+    return snapshots
+
+
+def test_levels_come_back_unchanged(app):
+    snapshots = make_levels(app)
+    # with one level kept in memory, the first was spilled to a file
+    assert [level.is_loaded() for level in app.levels.levels.values()] == [False, True]
+    assert app.change_level(None)
+    assert snapshot(app) == snapshots[None]
+    assert app.fov_map.get_explored(5, 5) and not app.fov_map.get_explored(7, 7)
+    assert app.change_level('a')
+    assert snapshot(app) == snapshots['a']
+    assert app.fov_map.get_explored(7, 7)
+    assert app.change_level('b')
+    assert snapshot(app) == snapshots['b']
+
+
+def test_save_state_keeps_every_level(app, tmpdir):
+    snapshots = make_levels(app)
+    path = str(tmpdir.join('save.json'))
+    app.save_state(path)
+    reserved = set(app.entity_manager.reserved)
+    app.load_state(path)
+    assert app.levels.current == 'b'
+    assert len(app.levels) == 2
+    assert app.entity_manager.reserved == reserved
+    assert snapshot(app) == snapshots['b']
+    assert app.change_level('a')
+    assert snapshot(app) == snapshots['a']
+    assert isinstance(app.fov_map, fov.FovMap) and app.fov_map.get_explored(7, 7)
+    assert app.change_level(None)
+    assert snapshot(app) == snapshots[None]
@@ -0,0 +1,142 @@
+import collections
+import json
+import os
+import random
+
+import lib.map as map
+import lib.material as material
+
+W, H = 70, 50
+CLASSES = (map.Map, map.ChunkedMap, map.MappedMap)
+
+
+def dump(mp):
+    """Returns every material ID of a map, border and a little past it included."""
+    return [mp.get_material(x, y) for y in range(-2, H+2) for x in range(-2, W+2)]
+
+
+def parse(lines):
+    """Returns save format lines parsed as they would be within a save file."""
+    return json.loads("\n".join(lines).rstrip(","))
+
+
+def ref_flood(mp, x, y, id):
+    """Flood fills a tile at a time, as maps did before flood_fill; Returns the number of tiles changed."""
+    if not (0 < x < W and 0 < y < H):
+        return 0
+    old = mp.get_material(x, y)
+    if old == id:
+        return 0
+    seen = set([(x, y)])
+    queue = collections.deque([(x, y)])
+    while queue:
+        a, b = queue.popleft()
+        for c, d in ((a+1, b), (a-1, b), (a, b+1), (a, b-1)):
+            if 0 < c < W and 0 < d < H and (c, d) not in seen and mp.get_material(c, d) == old:
+                seen.add((c, d))
+                queue.append((c, d))
+    for a, b in seen:
+        mp.set_material(a, b, id)
+    return len(seen)
+
+
+def apply_ops(r, ref, mp, count):
+    """Applies the same random bulk operations to mp, and to ref a tile at a time, checking they stay equal."""
+    for it in range(count):
+        op = r.randint(0, 3)
+        if op == 0:
+            x, y, w, h, id = r.randint(-10, W), r.randint(-10, H), r.randint(0, 30), r.randint(0, 20), r.randint(0, 1)
+            for j in range(h):
+                for i in range(w):
+                    ref.set_material(x+i, y+j, id)
+            mp.fill_rect(x, y, w, h, id)
+        elif op == 1:
+            x, y = r.randint(-5, W), r.randint(-5, H)
+            pattern = [''.join(chr(r.randint(0, 1)) for i in range(8)) for j in range(6)]
+            mask = [''.join(chr(r.random() < 0.5) for i in range(8)) for j in range(6)]
+            for j in range(6):
+                for i in range(8):
+                    if ord(mask[j][i]):
+                        ref.set_material(x+i, y+j, ord(pattern[j][i]))
+            mp.stamp(x, y, pattern, mask)
+        elif op == 2:
+            x, y, id = r.randint(-2, W+2), r.randint(-2, H+2), r.randint(0, 1)
+            assert mp.flood_fill(x, y, id) == ref_flood(ref, x, y, id)
+        else:
+            sx, sy, w, h = r.randint(-10, W), r.randint(-10, H), r.randint(0, 30), r.randint(0, 20)
+            x, y = r.randint(-10, W), r.randint(-10, H)
+            tiles = [[ref.get_material(sx+i, sy+j) for i in range(w)] for j in range(h)]
+            for j in range(h):
+                for i in range(w):
+                    ref.set_material(x+i, y+j, tiles[j][i])
+            mp.copy_region(mp, sx, sy, w, h, x, y)
+        assert dump(mp) == dump(ref), (op, it)
+
+
+def test_bulk_ops_match_tile_writes():
+    for cls in CLASSES:
+        apply_ops(random.Random(7), map.Map(W, H), cls(W, H), 300)
+
+
+def test_map_types_agree():
+    maps = [cls(W, H) for cls in CLASSES]
+    r = random.Random(3)
+    for k in range(2000):
+        x, y, id = r.randint(-3, W+3), r.randint(-3, H+3), r.choice([material.WALL, material.FLOOR])
+        for mp in maps:
+            mp.set_material(x, y, id)
+    first = maps[0]
+    for mp in maps[1:]:
+        for y in range(-3, H+3):
+            for x in range(-3, W+3):
+                assert mp.get_tile(x, y) == first.get_tile(x, y)
+                assert mp.get_blocking(x, y) == first.get_blocking(x, y)
+                assert mp.get_blocking_light(x, y) == first.get_blocking_light(x, y)
+        assert mp.get_rect(-4, -4, 40, 30) == first.get_rect(-4, -4, 40, 30)
+        view, first_view = mp.get_rect(60, 40, 20, 20, view=True), first.get_rect(60, 40, 20, 20, view=True)
+        for j in range(20):
+            assert [view.get_tile(i, j) for i in range(20)] == [first_view.get_tile(i, j) for i in range(20)]
+
+
+def test_save_formats_load_into_any_type():
+    r = random.Random(5)
+    for cls in CLASSES:
+        source = cls(W, H)
+        apply_ops(r, map.Map(W, H), source, 40)
+        data = parse(source.save())
+        for target in CLASSES:
+            assert dump(map.load_map(data, target)) == dump(source)
+
+
+def test_mapped_map_reopens_file(tmpdir):
+    path = str(tmpdir.join('level.map'))
+    mp = map.MappedMap(W, H)
+    mp.fill_rect(3, 4, 20, 10, material.FLOOR)
+    mp.set_file(path)
+    mp.set_material(30, 30, material.FLOOR)
+    data = parse(mp.save())
+    assert data["file"] == path
+    loaded = map.load_map(data)
+    assert isinstance(loaded, map.MappedMap)
+    assert dump(loaded) == dump(mp)
+    loaded.close()
+    mp.close()
+    os.remove(path)
+
+
+def test_writes_bump_versions_and_call_listeners():
+    for cls in CLASSES:
+        mp = cls(100, 80)
+        log = [ ]
+        mp.add_listener(lambda *area: log.append(area))
+        near, far = mp.get_version(5, 5), mp.get_version(80, 70)
+        mp.set_material(5, 5, material.FLOOR)
+        assert log == [(5, 5, 1, 1)]
+        assert mp.get_version(5, 5) != near
+        assert mp.get_version(80, 70) == far
+        mp.fill_rect(30, 30, 10, 3, material.FLOOR)
+        assert log[1:] == [(30, 30 + j, 10, 1) for j in range(3)]
+        assert mp.get_version(33, 32) == mp.version
+        assert mp.get_version(80, 70) == far
+        mp.clear()
+        assert mp.get_version(80, 70) == mp.get_version(5, 5) == mp.version
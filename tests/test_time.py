@@ -0,0 +1,107 @@
+import random
+
+import lib.time as time
+
+
+class OldScheduler(object):
+    """The scheduler as it was before the heap: A dict of tick to the tasks due on it, in the order they were added."""
+
+    def __init__(self):
+        self.ticks = 0
+        self.queue = { }
+        self.dominant = None
+
+    def add_schedule(self, set):
+        self.queue.setdefault(self.ticks + set[2], [ ]).append(set)
+        return set
+
+    def set_dominant(self, set):
+        self.dominant = set
+
+    def tick(self):
+        done = False
+        while not done:
+            sets = [ ]
+            while sets == [ ] and self.queue != { }:
+                sets = self.queue.pop(self.ticks, [ ])
+                self.ticks += 1
+            for set in sets:
+                set[0](*set[1])
+                self.add_schedule(set)
+                if self.dominant is set:
+                    done = True
+            if self.dominant is None:
+                done = True
+        return True
+
+
+def populate(scheduler, seed, log):
+    """Adds tasks with a spread of delays, and a dominant one; Each task logs the tick it ran on and its number."""
+    def task(i):
+        log.append((scheduler.ticks, i))
+    r = random.Random(seed)
+    for i in range(200):
+        scheduler.add_schedule((task, (i,), r.choice([1, 2, 3, 10, 10, 10, 17, 63, 64, 65, 300])))
+    scheduler.set_dominant(scheduler.add_schedule((task, ('dominant',), 10)))
+
+
+def run(scheduler, seed, turns=300):
+    log = [ ]
+    populate(scheduler, seed, log)
+    done = 0
+    while done < turns:
+        if scheduler.tick():
+            done += 1
+    return log
+
+
+def test_heap_runs_in_old_order():
+    for seed in range(3):
+        assert run(time.Scheduler(), seed) == run(OldScheduler(), seed)
+
+
+def test_wheel_runs_same_tasks_each_tick():
+    for seed in range(3):
+        assert sorted(run(time.WheelScheduler(), seed)) == sorted(run(OldScheduler(), seed))
+
+
+def test_budget_resumes_cut_tick():
+    for cls in (time.Scheduler, time.WheelScheduler):
+        whole = cls()
+        whole.enable_stats()
+        split = cls()
+        split.enable_stats()
+        split.set_budget(7)
+        assert run(split, 4) == run(whole, 4)
+        assert split.stats.ticks == whole.stats.ticks
+        assert split.stats.tasks == whole.stats.tasks
+
+
+def test_cancel_and_reschedule_match():
+    def run_changes(scheduler, seed):
+        log = [ ]
+        def task(i):
+            log.append((scheduler.ticks, i))
+            r = random.Random(hash((seed, scheduler.ticks, i)))
+            x = r.random()
+            if x < 0.05:
+                scheduler.cancel_schedule(i)
+            elif x < 0.15:
+                scheduler.reschedule(i, r.choice([0, 3, 10, 70, 5000]))
+        r = random.Random(seed)
+        for i in range(300):
+            scheduler.add_schedule((task, (i,), r.choice([0, 10, 10, 63, 64, 65, 4095, 4096])))
+        for k in range(3000):
+            scheduler.step()
+        return log
+    for seed in range(3):
+        assert sorted(run_changes(time.WheelScheduler(), seed)) == sorted(run_changes(time.Scheduler(), seed))
+
+
+def test_advance_skips_empty_ticks():
+    scheduler = time.Scheduler()
+    log = [ ]
+    scheduler.add_schedule((lambda: log.append(scheduler.ticks), (), 100))
+    assert scheduler.advance(250) == 2
+    assert log == [101, 202]
+    assert scheduler.ticks == 250
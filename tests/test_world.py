@@ -0,0 +1,60 @@
+import lib.fov as fov
+
+
+def snapshot(app):
+    """Returns every entity's ID, position and type, and the world map's chunks."""
+    em = app.entity_manager
+    ents = sorted((id, tuple(em.get_abs_pos(id) or ()), str(em[id].type)) for id in em)
+    return ents, app.map.save()
+
+
+def walk(app, steps, dx):
+    """Moves the player steps times by dx tiles, updating the world after each step."""
+    em = app.entity_manager
+    x, y = em.get_abs_pos(app.player)
+    for i in range(steps):
+        x += dx
+        em.set_pos(app.player, (x, y))
+        app.world.update()
+
+
+def test_chunks_come_back_unchanged(app):
+    world = app.start_world(1024)
+    app.place_player(10)
+    world.update()
+    start = snapshot(app)
+    x, y = app.entity_manager.get_abs_pos(app.player)
+    app.fov_map.set_explored(x, y)
+    walk(app, 40, 8)
+    assert world.stored
+    assert isinstance(app.fov_map, fov.ChunkedFovMap)
+    assert app.fov_map.get_chunk(*world.get_chunk(x, y)) is None
+    assert app.entity_manager.reserved == set().union(*world.stored.values())
+    walk(app, 40, -8)
+    # chunks come back in from their files, with their entities and explored state
+    assert app.fov_map.get_explored(x, y)
+    ents, tiles = snapshot(app)
+    assert ents == start[0]
+    assert not app.entity_manager.reserved
+
+
+def test_save_state_keeps_world(app, tmpdir):
+    world = app.start_world(1024)
+    app.place_player(10)
+    world.update()
+    walk(app, 40, 8)
+    assert world.stored
+    path = str(tmpdir.join('save.json'))
+    app.save_state(path)
+    saved = snapshot(app)
+    walk(app, 40, -8)
+    walk(app, 30, 8)
+    expected = snapshot(app)
+    # a different master seed, so new chunks only match if the world's own seed was saved
+    app.rng.seed(app.rng.master_seed + 1)
+    app.load_state(path)
+    assert app.world is not None and app.world is not world
+    assert snapshot(app) == saved
+    walk(app, 40, -8)
+    walk(app, 30, 8)
+    assert snapshot(app) == expected